@@ -1,50 +1,55 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 from app.schemas.dedup_log_schema import DedupLogOut
 
 from app.api.deps import get_db, require_admin
-from app.utils.full_dedup_engine import find_similar_disaster_infos
-from app.utils.merge_engine import merge_duplicate_clusters
+from app.utils.dedup_jobs import DedupJobConflict, start_dedup_job, request_cancel, job_status
+from app.utils.vector_index import disaster_index
+from app.utils.embedder import embedding_cache_stats
+from app.core.verdict_cache import verdict_cache
 from app.models.dedup_log import DedupLog
-from app.models.report import Report
-from sqlalchemy import func                 # ← 让聚合函数可用
-from app.models.disaster_info import DisasterInfo   # ← 用来计数
+from app.models.dedup_job import DedupJob
 
 
 router = APIRouter()
-# 去重 —— 仅管理员
-@router.post("/", dependencies=[Depends(require_admin)])
+# 去重 —— 仅管理员。后台任务执行，立即返回任务 id，进度通过 /dedup/jobs/{id} 查询
+@router.post("/", status_code=202, dependencies=[Depends(require_admin)])
 def run_dedup(db: Session = Depends(get_db)):
-    pairs = find_similar_disaster_infos(db)
-    merged, deleted, details = merge_duplicate_clusters(db, pairs)
-
-    # 写入去重日志
-    log = DedupLog(
-        duplicates_detected=len(pairs),
-        merged_clusters=merged,
-        deleted_records=deleted,
-    )
-    db.add(log)
-    orphan_reports = (
-        db.query(Report)
-        .outerjoin(Report.disaster_infos)
-        .group_by(Report.id)
-        .having(func.count(DisasterInfo.id) == 0)
-        .all()
-    )
-    for rpt in orphan_reports:
-        db.delete(rpt)
-        
-    db.commit()
-
-    return {
-        "duplicates_detected": len(pairs),
-        "merged_clusters": merged,
-        "deleted_records": deleted,
-        "cluster_details": details,
-    }
+    try:
+        job = start_dedup_job(db)
+    except DedupJobConflict as e:
+        raise HTTPException(status_code=409, detail=f"已有去重任务正在运行: {e.job_id}")
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}", dependencies=[Depends(require_admin)])
+def get_dedup_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(DedupJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="未找到该去重任务")
+    return job_status(job)
+
+@router.post("/jobs/{job_id}/cancel", dependencies=[Depends(require_admin)])
+def cancel_dedup_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(DedupJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="未找到该去重任务")
+    if job.status not in ("pending", "running"):
+        raise HTTPException(status_code=400, detail=f"任务已结束（{job.status}）")
+    request_cancel(db, job)
+    return job_status(job)
 
 @router.get("/logs", response_model=List[DedupLogOut], dependencies=[Depends(require_admin)])
 def get_dedup_logs(db: Session = Depends(get_db)):
-    return db.query(DedupLog).order_by(DedupLog.run_at.desc()).all()
\ No newline at end of file
+    return db.query(DedupLog).order_by(DedupLog.run_at.desc()).all()
+
+# 重建 / 压缩历史向量索引 —— 仅管理员
+@router.post("/index/rebuild", dependencies=[Depends(require_admin)])
+def rebuild_dedup_index(db: Session = Depends(get_db)):
+    total = disaster_index.rebuild(db)
+    return {"indexed_records": total}
+
+# 缓存命中统计 —— 仅管理员
+@router.get("/cache/stats", dependencies=[Depends(require_admin)])
+def get_cache_stats():
+    return {"embedding": embedding_cache_stats(), "llm_verdict": verdict_cache.stats()}
@@ -6,6 +6,10 @@ from app.db.session import get_db
 from app.models.disaster_info import DisasterInfo
 from app.schemas.disaster_info_schema import DisasterInfoUpdate, DisasterInfoOut
 from app.api.deps import require_admin
+from app.utils.embedding_store import drop_vectors
+from app.utils.vector_index import disaster_index
+from app.utils.report_search import sync_reports
+from app.utils.semantic_search import index_infos
 
 router = APIRouter(dependencies=[Depends(require_admin)])
 
@@ -14,8 +18,21 @@ def update_disaster_info(info_id: int, data: DisasterInfoUpdate, db: Session = D
     info = db.get(DisasterInfo, info_id)
     if not info:
         raise HTTPException(status_code=404, detail="未找到该灾情元组")
+    changed = False
     for field, value in data.dict(exclude_unset=True).items():
+        if getattr(info, field) != value:
+            changed = True
         setattr(info, field, value)
+    # 字段有改动时作废已存储的向量，并移出历史索引、重新标记为待比对，
+    # 下次去重时按新内容重新编码并与历史记录比对
+    if changed:
+        drop_vectors(db, [info.id])
+        info.has_been_checked = False
+        db.flush()
+        sync_reports(db, [info.report_id])
     db.commit()
     db.refresh(info)
+    if changed:
+        disaster_index.remove([info.id])
+        index_infos([info])
     return info
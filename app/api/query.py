@@ -3,101 +3,233 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from starlette.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from io import BytesIO
-import pandas as pd
-from sqlalchemy.orm import joinedload
+from typing import List, Optional
+from collections import OrderedDict
+import base64
+import json
+import os
+import threading
+import time
+from sqlalchemy.orm import selectinload
 from app.models.disaster_info import DisasterInfo
-from sqlalchemy import or_
+from sqlalchemy import and_, func, or_
 from app.api.deps import get_db, require_active_user
+from app.db.session import SessionLocal
 from app.models.report import Report
-from app.schemas.report_schema import ReportOut, ReportListOut
+from app.schemas.report_schema import ReportOut, ReportListOut, SemanticReportOut, SemanticReportListOut
+from app.utils.semantic_search import parse_date_bound, semantic_report_hits
+from app.utils.report_search import search_hits
+from app.utils.report_export import EXPORT_FORMATS, iter_export_rows, stream_csv, stream_xlsx
+from app.api.report import reports_out
 
 router = APIRouter()
 
+# 列表总数的缓存时长（秒）与最多缓存的关键词数
+COUNT_CACHE_TTL = float(os.getenv("REPORT_COUNT_TTL", "10"))
+COUNT_CACHE_SIZE = 256
+_count_cache: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+_count_lock = threading.Lock()
+
+
+def _search_reports(db: Session, q: str = None):
+    """
+    按关键词筛选报告，返回 (query, score)：有全文索引时 score 为相关度列（越小越相关，同分按 id 倒序），
+    否则退回对摘要和四元组字段的 LIKE 匹配、按 id 倒序，score 为 None。
+    """
+    query = db.query(Report)
+    if not q:
+        return query.order_by(Report.id.desc()), None
+
+    hits = search_hits(db, q)
+    if hits is not None:
+        return query.join(hits, hits.c.report_id == Report.id)\
+                    .order_by(hits.c.score, Report.id.desc()), hits.c.score
+
+    return query.join(Report.disaster_infos).filter(
+        or_(
+            Report.summary.contains(q),
+            DisasterInfo.time.contains(q),
+            DisasterInfo.location.contains(q),
+            DisasterInfo.event.contains(q),
+            DisasterInfo.level.contains(q),
+        )
+    ).distinct().order_by(Report.id.desc()), None
+
+
+def _encode_cursor(report_id: int, score: float = None) -> str:
+    raw = json.dumps([report_id] if score is None else [report_id, score])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """返回 (report_id, score)；游标不合法时抛出 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        return int(values[0]), (float(values[1]) if len(values) > 1 else None)
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def apply_cursor(query, cursor: str, score=None):
+    """
+    键集分页：只取排在游标之后的记录（顺序为 score 升序、id 倒序），
+    翻到任何一页的代价都只与页大小有关。
+    """
+    last_id, last_score = _decode_cursor(cursor)
+    if score is not None and last_score is not None:
+        return query.filter(or_(score > last_score, and_(score == last_score, Report.id < last_id)))
+    return query.filter(Report.id < last_id)
+
+
+def fetch_page(query, page_size: int, cursor: str = None, page: int = 1, score=None) -> tuple[list, Optional[str]]:
+    """
+    取一页报告（子表用 selectinload 只为本页的报告加载），返回 (reports, next_cursor)。
+    传了 cursor 走键集分页；否则按 page 用 OFFSET 兼容旧的页码参数。
+    """
+    if cursor:
+        query = apply_cursor(query, cursor, score)
+    elif page > 1:
+        query = query.offset((page - 1) * page_size)
+    query = query.options(selectinload(Report.disaster_infos))
+    if score is not None:
+        rows = query.add_columns(score).limit(page_size + 1).all()
+        reports, scores = [r for r, _ in rows], [sc for _, sc in rows]
+    else:
+        reports = query.limit(page_size + 1).all()
+        scores = None
+
+    next_cursor = None
+    if len(reports) > page_size:
+        reports = reports[:page_size]
+        last = reports[-1]
+        next_cursor = _encode_cursor(last.id, scores[page_size - 1] if scores else None)
+    return reports, next_cursor
+
+
+def _cached_count(db: Session, q: str, query) -> int:
+    """总数按关键词缓存 COUNT_CACHE_TTL 秒，避免每次翻页 / 自动刷新都重新计数"""
+    key = q or ""
+    now = time.monotonic()
+    with _count_lock:
+        hit = _count_cache.get(key)
+        if hit is not None and now - hit[1] < COUNT_CACHE_TTL:
+            _count_cache.move_to_end(key)
+            return hit[0]
+    if q:
+        total = query.order_by(None).count()
+    else:
+        total = db.query(func.count(Report.id)).scalar()
+    with _count_lock:
+        _count_cache[key] = (total, now)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
+
+
 # 查询所有报告,有参时启动关键词搜索 —— 仅已认证用户
 @router.get("/", response_model= ReportListOut , dependencies=[Depends(require_active_user)])
 def list_reports(
     q: str = None, 
     page: int = Query(1, ge=1), 
     page_size: int = Query(10, ge=1), 
+    cursor: Optional[str] = None,
+    with_total: bool = True,
     db: Session = Depends(get_db)
 ):
-    query = db.query(Report).options(joinedload(Report.disaster_infos))
-    
-    if q:
-        query = query.join(Report.disaster_infos).filter(
-            or_(
-                Report.summary.contains(q),
-                DisasterInfo.time.contains(q),
-                DisasterInfo.location.contains(q),
-                DisasterInfo.event.contains(q),
-                DisasterInfo.level.contains(q),
-            )
-        ).distinct()
-    
-    total = query.count()  # 总数
-
-    reports = query.order_by(Report.id.desc())\
-                   .offset((page - 1) * page_size)\
-                   .limit(page_size)\
-                   .all()
+    """
+    分页查询报告。推荐使用返回的 next_cursor 翻页（键集分页，深翻页不变慢）；
+    仍支持 page 页码参数。with_total=false 时不计算总数，total 为 null。
+    """
+    query, score = _search_reports(db, q)
+
+    total = _cached_count(db, q, query) if with_total else None  # 总数（缓存）
+
+    reports, next_cursor = fetch_page(query, page_size, cursor=cursor, page=page, score=score)
 
     return {
-        "items": reports,
-        "total": total
+        "items": reports_out(db, reports),
+        "total": total,
+        "next_cursor": next_cursor,
     }
 
+# 语义检索 —— 仅已认证用户（须定义在 /{report_id} 之前）
+@router.get("/semantic", response_model=SemanticReportListOut, dependencies=[Depends(require_active_user)])
+def semantic_reports(
+    q: str,
+    k: int = Query(50, ge=1, le=500),
+    page_size: int = Query(10, ge=1),
+    cursor: Optional[str] = None,
+    event: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    按语义相似度检索报告：查询文本用去重同一模型编码，在全部四元组的检索索引中检索，
+    先按事件类别（event）和时间范围（date_from / date_to，如 2024-09、2024年9月）筛选，再取最相近的 k 条报告。
+    分页方式与 GET /reports 相同（next_cursor）。新入库的四元组提交后即写入索引，不必等去重比对。
+    """
+    bounds = []
+    for value, upper in ((date_from, False), (date_to, True)):
+        bound = parse_date_bound(value, upper) if value else None
+        if value and bound is None:
+            raise HTTPException(status_code=400, detail=f"无法解析日期：{value}")
+        bounds.append(bound)
+
+    # 分数取相似度的相反数，与关键词检索一致：越小越靠前，同分按 id 倒序
+    ranked = [(-sim, rid) for rid, sim in semantic_report_hits(db, q, k, event, *bounds)]
+    total = len(ranked)
+    if cursor:
+        last_id, last_score = _decode_cursor(cursor)
+        if last_score is None:
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+        ranked = [(sc, rid) for sc, rid in ranked if sc > last_score or (sc == last_score and rid < last_id)]
+    page = ranked[:page_size]
+
+    reports = {
+        r.id: r for r in
+        db.query(Report).options(selectinload(Report.disaster_infos))
+        .filter(Report.id.in_([rid for _, rid in page]))
+    } if page else {}
+    found = [(sc, reports[rid]) for sc, rid in page if rid in reports]
+    items = [
+        SemanticReportOut(**out.model_dump(), similarity=-sc)
+        for (sc, _), out in zip(found, reports_out(db, [rpt for _, rpt in found]))
+    ]
+    next_cursor = _encode_cursor(page[-1][1], page[-1][0]) if len(ranked) > page_size else None
+    return {"items": items, "total": total, "next_cursor": next_cursor}
+
 #导出excel —— 仅已认证用户
 @router.get("/export_excel")
 def export_reports_excel(
     q: str = None,
-    db: Session = Depends(get_db),
+    fmt: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|csv\\.gz)$"),
     user=Depends(require_active_user)
 ):
-    query = db.query(Report).options(joinedload(Report.disaster_infos))
+    """
+    流式导出：分块读库、边生成边输出，峰值内存与导出规模无关。format 可选 xlsx / csv / csv.gz。
+    """
+    media_type, filename = EXPORT_FORMATS[fmt]
+
+    def stream():
+        # 响应流在请求的依赖（含数据库会话）退出之后才被消费，这里使用独立会话
+        db = SessionLocal()
+        try:
+            report_ids = _search_reports(db, q)[0].with_entities(Report.id) if q else None
+            rows = iter_export_rows(db, report_ids)
+            if fmt == "xlsx":
+                yield from stream_xlsx(rows)
+            else:
+                yield from stream_csv(rows, gzip=fmt == "csv.gz")
+        finally:
+            db.close()
 
-    if q:
-        from sqlalchemy import or_
-        from app.models.disaster_info import DisasterInfo
-        query = query.join(Report.disaster_infos).filter(
-            or_(
-                Report.summary.contains(q),
-                DisasterInfo.time.contains(q),
-                DisasterInfo.location.contains(q),
-                DisasterInfo.event.contains(q),
-                DisasterInfo.level.contains(q),
-            )
-        ).distinct()
-
-    reports = query.all()
-
-    # 数据准备
-    data = []
-    for rpt in reports:
-        for info in rpt.disaster_infos:
-            data.append({
-                "报告ID": rpt.id,
-                "摘要": rpt.summary,
-                "上报时间": rpt.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "时间": info.time,
-                "地点": info.location,
-                "灾害类型": info.event,
-                "受灾程度": info.level,
-                "上报次数": info.report_count,
-            })
-
-    df = pd.DataFrame(data)
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="灾情报告")
-
-    output.seek(0)
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=report_export.xlsx"}
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 # （可选）查询单条报告 —— 仅已认证用户
@@ -110,5 +242,5 @@ def get_report(report_id: int, db: Session = Depends(get_db)):
     rpt = db.get(Report, report_id)
     if not rpt:
         raise HTTPException(status_code=404, detail="未找到该报告")
-    return rpt
+    return reports_out(db, [rpt])[0]
 
@@ -1,39 +1,224 @@
 # app/api/report.py
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, File, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import asyncio
 import datetime
+import json
+import os
+import shutil
+import tempfile
+import time
 
 from app.api.deps import get_db, require_active_user, require_admin
-from app.schemas.report_schema import ReportCreate, ReportOut
+from app.db.session import SessionLocal
+from app.schemas.report_schema import ReportCreate, ReportOut, ReportStatusOut
+from app.schemas.disaster_info_schema import DisasterInfoOut
 from app.models.report import Report
 from app.core.llm_service import generate_report_info
+from app.utils.embedding_store import drop_vectors
+from app.utils.vector_index import disaster_index
+from app.utils.semantic_search import index_infos, unindex_infos
+from app.utils.online_dedup import STREAMING_ENABLED, check_new_infos
+from app.utils.ingest_worker import INGEST_ASYNC, FINAL_STATUSES, submit_report
+from app.utils.report_search import sync_reports
+from app.utils.near_dup import (
+    NEAR_DUP_ENABLED, find_duplicate, hand_over_duplicates, link_duplicate, set_fingerprint, shared_infos,
+    unlink_duplicate,
+)
+from app.utils.bulk_ingest import (
+    BULK_BATCH_SIZE, BULK_CONCURRENCY, SUPPORTED_FORMATS, bulk_ingest, detect_format, iter_rows,
+)
 
 router = APIRouter()
 
+# 订阅抽取结果时的轮询间隔与最长等待（秒）
+EVENTS_POLL_SECS = 0.5
+EVENTS_TIMEOUT_SECS = 300
+
+
+def reports_out(db: Session, reports) -> list[ReportOut]:
+    """原文重复的报告本身没有四元组，返回时带上被复用报告的四元组（列表、单条、检索共用）"""
+    shared = shared_infos(db, reports)
+    out = []
+    for rpt in reports:
+        item = ReportOut.model_validate(rpt)
+        if rpt.id in shared:
+            item.disaster_infos = [DisasterInfoOut.model_validate(d) for d in shared[rpt.id]]
+        out.append(item)
+    return out
+
+
+def _report_out(db: Session, rpt: Report) -> ReportOut:
+    return reports_out(db, [rpt])[0]
+
+
 # 创建报告 —— 仅已认证用户
 @router.post(
     "/",
     response_model=ReportOut,
     dependencies=[Depends(require_active_user)]
 )
-def create_report(report_in: ReportCreate, db: Session = Depends(get_db)):
-    try:
-        summary, disaster_infos = generate_report_info(report_in.text)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"模型推理失败: {e}")
+def create_report(
+    report_in: ReportCreate,
+    background_tasks: BackgroundTasks,
+    wait: Optional[bool] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    wait=true：同步抽取后返回完整报告（原有行为）；
+    wait=false：原文立即入库并返回 202 {report_id, status: pending}，抽取在后台线程池中进行，
+    可通过 GET /report/{id}/status 轮询或 GET /report/{id}/events 订阅完成事件。
+    未指定时由 REPORT_INGEST_ASYNC 决定。
+    原文与近期某条报告精确 / 近似重复时直接复用其摘要与四元组，不调用 LLM（见 app/utils/near_dup.py）。
+    """
+    if wait is None:
+        wait = not INGEST_ASYNC
     report = Report(
         text=report_in.text,
-        summary=summary,
+        summary="",
+        status="done" if wait else "pending",
         created_at=datetime.datetime.utcnow(),
-        disaster_infos=disaster_infos
     )
+    set_fingerprint(report)
+    if not wait:
+        db.add(report)
+        db.commit()
+        submit_report(report.id)
+        return JSONResponse(status_code=202, content={"report_id": report.id, "status": "pending"})
+
+    original = find_duplicate(db, report_in.text) if NEAR_DUP_ENABLED else None
+    if original is not None:
+        link_duplicate(db, report, original.id, original.summary)
+        db.add(report)
+        db.flush()
+        sync_reports(db, [report.id])
+        db.commit()
+        return _report_out(db, report)
+
+    try:
+        report.summary, report.disaster_infos = generate_report_info(report_in.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"模型推理失败: {e}")
     db.add(report)
+    db.flush()
+    sync_reports(db, [report.id])
     db.commit()
     db.refresh(report)
+    index_infos(report.disaster_infos)
+    # 在线去重：响应返回后在后台与历史记录比对
+    if STREAMING_ENABLED:
+        background_tasks.add_task(check_new_infos, [d.id for d in report.disaster_infos])
     return report
 
+# 批量导入 —— 仅已认证用户
+@router.post(
+    "/bulk",
+    dependencies=[Depends(require_active_user)]
+)
+async def bulk_upload(
+    file: UploadFile = File(...),
+    concurrency: int = BULK_CONCURRENCY,
+    batch_size: int = BULK_BATCH_SIZE,
+):
+    """
+    上传 JSONL（每行 {"text": ...}）、CSV 或 xlsx（表头含 text / 原文 / 内容 列，否则取第一列），
+    并发抽取、分批入库，以 NDJSON 流式返回每行的结果，最后一行为汇总。
+    concurrency、batch_size 分别不超过 BULK_INGEST_MAX_CONCURRENCY、BULK_INGEST_MAX_BATCH_SIZE。
+    """
+    fmt = detect_format(file.filename)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"仅支持 {' / '.join(SUPPORTED_FORMATS)} 文件")
+
+    # 上传文件在请求结束时会被关闭，先转存到临时文件，再由响应流按行读取
+    suffix = os.path.splitext(file.filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        await run_in_threadpool(shutil.copyfileobj, file.file, tmp)
+        path = tmp.name
+
+    info_ids = []
+
+    def stream():
+        try:
+            for event in bulk_ingest(iter_rows(path, fmt), concurrency, batch_size):
+                info_ids.extend(event.pop("info_ids", []))
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"[批量导入异常] {e}")
+            yield json.dumps({"status": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            os.remove(path)
+
+    # 在线去重放到响应流结束之后的后台任务里，不占用流的最后一行，也不阻塞客户端收尾
+    background = BackgroundTask(check_new_infos, info_ids) if STREAMING_ENABLED else None
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=background)
+
+
+def _status_payload(rpt: Report) -> dict:
+    return {"report_id": rpt.id, "status": rpt.status, "error": rpt.error}
+
+
+# 查询抽取状态 —— 仅已认证用户
+@router.get(
+    "/{report_id}/status",
+    response_model=ReportStatusOut,
+    dependencies=[Depends(require_active_user)]
+)
+def get_report_status(report_id: int, db: Session = Depends(get_db)):
+    rpt = db.get(Report, report_id)
+    if not rpt:
+        raise HTTPException(status_code=404, detail="未找到该报告")
+    return _status_payload(rpt)
+
+
+def _read_status(report_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        rpt = db.get(Report, report_id)
+        return _status_payload(rpt) if rpt else None
+    finally:
+        db.close()
+
+
+# 订阅抽取完成事件（Server-Sent Events）—— 仅已认证用户
+@router.get(
+    "/{report_id}/events",
+    dependencies=[Depends(require_active_user)]
+)
+async def report_events(report_id: int):
+    """
+    状态每变化一次推送一条 event: status；进入 done / failed 后推送最终状态并结束。
+    以数据库为准轮询，抽取在其他 worker 进程中进行时同样适用。
+    """
+    state = await run_in_threadpool(_read_status, report_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="未找到该报告")
+
+    async def stream():
+        nonlocal state
+        last = None
+        deadline = time.monotonic() + EVENTS_TIMEOUT_SECS
+        while True:
+            if state is None:
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            if state != last:
+                yield f"event: status\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                last = state
+            if state["status"] in FINAL_STATUSES:
+                return
+            if time.monotonic() > deadline:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            await asyncio.sleep(EVENTS_POLL_SECS)
+            state = await run_in_threadpool(_read_status, report_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # （可选）查看单条报告 —— 仅已认证用户
 @router.get(
     "/{report_id}",
@@ -44,7 +229,7 @@ def get_report(report_id: int, db: Session = Depends(get_db)):
     rpt = db.get(Report, report_id)
     if not rpt:
         raise HTTPException(status_code=404, detail="未找到该报告")
-    return rpt
+    return _report_out(db, rpt)
 
 # 更新报告 —— 仅管理员
 @router.put(
@@ -57,11 +242,24 @@ def update_report(report_id: int, data: ReportCreate, db: Session = Depends(get_
     if not rpt:
         raise HTTPException(status_code=404, detail="未找到该报告")
     # 根据需要，你也可以只更新 text，或者全文重新推理
+    # 原文被替换：本身是重复的撤回计数，被其他报告复用的把旧抽取结果移交给其重复报告
+    unlink_duplicate(db, rpt)
+    heir = hand_over_duplicates(db, rpt)
+    old_ids = [d.id for d in rpt.disaster_infos]
     rpt.text = data.text
     rpt.summary, rpt.disaster_infos = generate_report_info(data.text)
+    rpt.status, rpt.error = "done", None
+    set_fingerprint(rpt)
+    # 旧四元组随 delete-orphan 删除，其向量与历史索引条目一并清理（同 delete_report）
+    drop_vectors(db, old_ids)
+    db.flush()
+    sync_reports(db, [rpt.id] + ([heir.id] if heir else []))
     db.commit()
     db.refresh(rpt)
-    return rpt
+    disaster_index.remove(old_ids)
+    unindex_infos(old_ids)
+    index_infos(rpt.disaster_infos)
+    return _report_out(db, rpt)
 
 # 删除报告 —— 仅管理员
 @router.delete(
@@ -72,6 +270,15 @@ def delete_report(report_id: int, db: Session = Depends(get_db)):
     rpt = db.get(Report, report_id)
     if not rpt:
         raise HTTPException(status_code=404, detail="未找到该报告")
+    # 本身是重复的撤回计数；被其他报告复用的把四元组移交给其重复报告，不随之删除
+    unlink_duplicate(db, rpt)
+    heir = hand_over_duplicates(db, rpt)
+    info_ids = [d.id for d in rpt.disaster_infos]
     db.delete(rpt)
+    drop_vectors(db, info_ids)
+    db.flush()
+    sync_reports(db, [report_id] + ([heir.id] if heir else []))
     db.commit()
+    disaster_index.remove(info_ids)
+    unindex_infos(info_ids)
     return {"detail": "删除成功"}
@@ -1,14 +1,48 @@
 # app/core/llm_service.py
+import asyncio
+import json
 import os
+import random
 import re
-import requests
+import threading
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from app.models.disaster_info import DisasterInfo
+from app.core.verdict_cache import verdict_cache, verdict_key
 from dotenv import load_dotenv
 
 load_dotenv()
 LLM_API_URL = os.getenv("LLM_API_URL")
 LLM_MODEL = os.getenv("LLM_MODEL_NAME")
 TIMEOUT_SECS = 60
+# 建连超时与读超时分开：后端不可达时尽快失败，生成较慢时仍等待足够久
+CONNECT_TIMEOUT_SECS = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT_SECS = float(os.getenv("LLM_READ_TIMEOUT", str(TIMEOUT_SECS)))
+# 连接池大小，应不小于各引擎的 LLM 并发数之和
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+# 可重试错误（连接失败、超时、429/5xx）的最大重试次数，以及指数退避的基数 / 上限（秒）
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# 熔断：连续失败达到阈值后在冷却期内直接失败，冷却结束后放行一次试探请求
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# 相似度判定提示词版本，修改 sim_prompt 时需同步递增，旧的缓存结论随之失效
+SIM_PROMPT_VERSION = "v1"
+# 批量相似度判定时单次请求最多携带的文本对数
+SIM_BATCH_SIZE = int(os.getenv("LLM_SIM_BATCH_SIZE", "10"))
+
+# 报告抽取模式：two_step —— 先生成摘要再从摘要抽取四元组（两次调用）；
+#               single   —— 一次调用以 JSON 同时返回摘要和四元组，解析失败时退回 two_step
+LLM_EXTRACT_MODE = os.getenv("LLM_EXTRACT_MODE", "two_step")
+# 单次调用模式的输出上限（需要同时容纳摘要和全部四元组）
+SINGLE_CALL_MAX_TOKENS = int(os.getenv("LLM_SINGLE_CALL_MAX_TOKENS", "1024"))
+# 长文本分块抽取：估算超过该 token 数的原文按段落 / 句子切成不超过该预算的块，各块并发抽取后合并
+CHUNK_TOKEN_BUDGET = int(os.getenv("LLM_CHUNK_TOKEN_BUDGET", "1500"))
+# 单篇长文本同时在途的分块抽取数
+CHUNK_CONCURRENCY = int(os.getenv("LLM_CHUNK_CONCURRENCY", "4"))
 
 # 正则用于解析四元组
 _QUADRUPLE_RE = re.compile(
@@ -19,17 +53,182 @@ _QUADRUPLE_RE = re.compile(
     re.S,
 )
 
+# 切句：句末标点（含后随的引号 / 括号）之后断开
+_SENTENCE_RE = re.compile(r"[^。！？；!?;\n]*(?:[。！？；!?;]+[”’」』）)]*|$)")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
 
-def _call_chat_llm(messages: list, max_tokens: int = 512, temperature: float = 0.7) -> str:
-    payload = {
+# 解析批量判定结果，每行形如“3: 是”
+_BATCH_VERDICT_RE = re.compile(r"^\s*(?:编号)?\s*(\d+)\s*[:：.、]\s*(是|否)", re.M)
+
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """熔断器处于打开状态，LLM 后端暂不可用"""
+
+
+class _CircuitBreaker:
+    """连续失败计数熔断器，同步 / 异步调用共用一份状态"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self._opened_at < self.cooldown:
+                raise LLMUnavailable("LLM 后端连续失败，熔断中")
+            # 冷却结束：放行这一次试探请求，其余请求在新的冷却窗口内继续快速失败
+            self._opened_at = now
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    print(f"[LLM] 连续失败 {self._failures} 次，熔断 {self.cooldown}s")
+                self._opened_at = time.monotonic()
+
+
+_breaker = _CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+_client_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _client_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(READ_TIMEOUT_SECS, connect=CONNECT_TIMEOUT_SECS),
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        ),
+    }
+
+
+def _get_client() -> httpx.Client:
+    """进程内共享的同步连接池（keep-alive），首次调用时创建"""
+    global _sync_client
+    if _sync_client is None:
+        with _client_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(**_client_options())
+    return _sync_client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """异步连接池，供 async 接口使用；与同步连接池配置、熔断状态相同，同样加锁避免并发首次调用时重复创建"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+def close_llm_clients():
+    """关闭连接池（应用关闭时调用）"""
+    global _sync_client, _async_client
+    with _client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+        client, _async_client = _async_client, None
+    if client is not None:
+        try:
+            asyncio.get_running_loop().create_task(client.aclose())
+        except RuntimeError:
+            asyncio.run(client.aclose())
+
+
+def _chat_payload(messages: list, max_tokens: int, temperature: float) -> dict:
+    return {
         "model": LLM_MODEL,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature,
     }
-    response = requests.post(LLM_API_URL, json=payload, timeout=TIMEOUT_SECS)
-    response.raise_for_status()
-    return response.json()["choices"][0]["message"]["content"].strip()
+
+
+def _backoff_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """带全抖动的指数退避；429/503 带 Retry-After 时以其为下限"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    if response is not None:
+        try:
+            delay = max(delay, min(LLM_BACKOFF_MAX, float(response.headers.get("Retry-After", 0))))
+        except ValueError:
+            pass
+    return delay
+
+
+def _should_retry(attempt: int, error: Exception) -> Optional[httpx.Response]:
+    """
+    判断一次失败是否可重试：连接错误、超时、429/5xx 可重试，其余（如 400/401）直接抛出。
+    可重试时返回出错的响应（可能为 None）；不可重试或次数用尽时抛出原异常。
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        if error.response.status_code not in _RETRY_STATUS:
+            _breaker.record_success()  # 后端可达，只是请求本身有问题
+            raise error
+        response = error.response
+    elif isinstance(error, httpx.TransportError):
+        response = None
+    else:
+        raise error
+    _breaker.record_failure()
+    if attempt >= LLM_MAX_RETRIES:
+        raise error
+    return response
+
+
+def _call_chat_llm(messages: list, max_tokens: int = 512, temperature: float = 0.7) -> str:
+    """
+    通过共享连接池调用 LLM；可重试错误按抖动指数退避重试，熔断期间直接抛出 LLMUnavailable。
+    """
+    payload = _chat_payload(messages, max_tokens, temperature)
+    attempt = 0
+    while True:
+        _breaker.before_call()
+        try:
+            response = _get_client().post(LLM_API_URL, json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            failed = _should_retry(attempt, e)
+            time.sleep(_backoff_delay(attempt, failed))
+            attempt += 1
+            continue
+        _breaker.record_success()
+        return response.json()["choices"][0]["message"]["content"].strip()
+
+
+async def _acall_chat_llm(messages: list, max_tokens: int = 512, temperature: float = 0.7) -> str:
+    """_call_chat_llm 的异步版本，重试、退避与熔断策略相同"""
+    payload = _chat_payload(messages, max_tokens, temperature)
+    attempt = 0
+    while True:
+        _breaker.before_call()
+        try:
+            response = await _get_async_client().post(LLM_API_URL, json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            failed = _should_retry(attempt, e)
+            await asyncio.sleep(_backoff_delay(attempt, failed))
+            attempt += 1
+            continue
+        _breaker.record_success()
+        return response.json()["choices"][0]["message"]["content"].strip()
 
 
 def _parse_quadruples(raw: str) -> list[DisasterInfo]:
@@ -48,12 +247,8 @@ def _parse_quadruples(raw: str) -> list[DisasterInfo]:
         )
     return infos
 
-def generate_report_info(raw_text: str) -> tuple[str, list[DisasterInfo]]:
-    """
-    两步推理：
-    1. 生成摘要
-    2. 从摘要提取四元组
-    """
+def _summarize(raw_text: str) -> str:
+    """两步推理的第一步：生成摘要"""
     # 第一步提示词
     summary_prompt = (
     "你是一个灾害信息处理专家，任务是把给定的灾情长文本，生成一段简短的结构化摘要，突出主要信息。\n\n"
@@ -70,8 +265,11 @@ def generate_report_info(raw_text: str) -> tuple[str, list[DisasterInfo]]:
         {"role": "system", "content": summary_prompt},
         {"role": "user", "content": raw_text}
     ]
-    summary = _call_chat_llm(summary_messages, max_tokens=512, temperature=0.7)
+    return _call_chat_llm(summary_messages, max_tokens=512, temperature=0.7)
+
 
+def _extract_quadruples(summary: str) -> list[DisasterInfo]:
+    """两步推理的第二步：从摘要提取四元组"""
     # 第二步提示词
     quadruple_prompt = (
     "你是一名结构化信息提取专家，擅长将灾害类摘要内容准确拆分为【时间】-【地点】-【事件】-【受灾程度】四元组。请注意:\n\n"
@@ -130,12 +328,161 @@ def generate_report_info(raw_text: str) -> tuple[str, list[DisasterInfo]]:
         {"role": "user", "content": summary}
     ]
     quadruple_text = _call_chat_llm(quadruple_messages, max_tokens=512, temperature=0.7)
-    disaster_infos = _parse_quadruples(quadruple_text)
-    return summary, disaster_infos
+    return _parse_quadruples(quadruple_text)
 
-def llm_check_similarity(text1: str, text2: str) -> bool:
+
+def _parse_extraction_json(raw: str) -> Optional[tuple[str, list[DisasterInfo]]]:
+    """
+    解析单次调用模式的 JSON 输出并校验结构；不合法时返回 None。
+    允许输出被 ```json 代码块包裹或前后带少量说明文字。
+    """
+    start, end = raw.find("{"), raw.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(raw[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    summary, events = data.get("summary"), data.get("events")
+    if not isinstance(summary, str) or not summary.strip() or not isinstance(events, list):
+        return None
+
+    infos: list[DisasterInfo] = []
+    for item in events:
+        if not isinstance(item, dict):
+            return None
+        fields = {}
+        for key in ("time", "location", "event", "level"):
+            value = item.get(key)
+            if value is not None and not isinstance(value, str):
+                value = str(value)
+            fields[key] = (value or "").strip() or "未知"
+        if fields["event"] == "未知" and fields["level"] == "未知":
+            continue  # 既无事件也无受灾程度，不构成有效四元组
+        infos.append(DisasterInfo(**fields))
+    return summary.strip(), infos
+
+
+def _generate_single_call(raw_text: str) -> Optional[tuple[str, list[DisasterInfo]]]:
+    """单次调用：同时生成摘要和四元组；输出无法解析时返回 None"""
+    extract_prompt = (
+    "你是一个灾害信息处理专家，任务是阅读给定的灾情长文本，一次性完成摘要和结构化四元组提取。\n\n"
+    "摘要要求：\n"
+    "1. 判断文本中有多少个【独立的灾害事件】（灾害发生的时间、地点、类型、影响不同视为独立事件）。若原文中仅有一句简单事件描述，请直接保留原文内容。\n"
+    "2. 每个事件单独写一句话，句子顺序保持与原文一致，句子间用“。”结束，不换行，不添加其他解释或编号。\n"
+    "3. 不得猜测或补充原文未出现的信息；内容完全相同的事件仅保留一条。\n\n"
+    "四元组要求（每个独立事件一条）：\n"
+    "1. time：事件发生时间；location：事件发生地点。原文缺失时填写“未知”。\n"
+    "2. event：只填写精炼的灾害类型词汇（如：台风、洪水、地震、山体滑坡等），不要添加其他描述。\n"
+    "3. level：仅填写该事件的影响程度（如：多处电力中断、造成3人失联等），不要包含灾害名称。\n"
+    "4. 同一句话中出现多个地点、时间或受灾描述时，根据上下文拆分成多条，确保各字段对应正确。\n\n"
+    "只输出一个 JSON 对象，不要输出任何其他内容，格式如下：\n"
+    "{\"summary\": \"<摘要>\", \"events\": [{\"time\": \"<时间>\", \"location\": \"<地点>\", \"event\": \"<灾害类型>\", \"level\": \"<受灾程度>\"}]}\n\n"
+    "示例：\n"
+    "{\"summary\": \"2024年9月15日，台风“银海”袭击广东省珠海市，多条道路积水严重。9月16日凌晨，惠州市突发山体滑坡，造成3人失联。\", "
+    "\"events\": [{\"time\": \"2024年9月15日\", \"location\": \"广东省珠海市\", \"event\": \"台风\", \"level\": \"多条道路积水严重\"}, "
+    "{\"time\": \"2024年9月16日凌晨\", \"location\": \"惠州市\", \"event\": \"山体滑坡\", \"level\": \"造成3人失联\"}]}\n\n"
+    "文本如下：\n"
+    )
+    messages = [
+        {"role": "system", "content": extract_prompt},
+        {"role": "user", "content": raw_text}
+    ]
+    raw = _call_chat_llm(messages, max_tokens=SINGLE_CALL_MAX_TOKENS, temperature=0.3)
+    return _parse_extraction_json(raw)
+
+
+def _extract(raw_text: str, mode: str) -> tuple[tuple[str, list[DisasterInfo]], str]:
+    """按 mode 抽取一段文本，返回 (结果, 实际使用的模式)"""
+    if mode == "single":
+        result = _generate_single_call(raw_text)
+        if result is not None:
+            return result, mode
+        print("[报告抽取] 单次调用输出无法解析，退回两步推理")
+        mode = "single->two_step"
+    summary = _summarize(raw_text)
+    return (summary, _extract_quadruples(summary)), mode
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：汉字约 1 token / 字，其余字符约 4 字符 / token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _split_text(raw_text: str, budget: int = CHUNK_TOKEN_BUDGET) -> list[str]:
     """
-    判断两条灾情是否属于相同事件
+    按段落切块，段落过长时再按句子切，单句仍超预算时按字符硬切；
+    相邻的片段在不超过 budget 的前提下合并成尽量大的块，保持原文顺序。
+    """
+    pieces = []
+    for para in re.split(r"\n\s*\n|\n", raw_text):
+        para = para.strip()
+        if not para:
+            continue
+        if _estimate_tokens(para) <= budget:
+            pieces.append(para)
+            continue
+        for sent in _SENTENCE_RE.findall(para):
+            sent = sent.strip()
+            while sent:
+                # 汉字为主的文本 1 字约 1 token，按 budget 个字符硬切足够保守
+                head, sent = (sent, "") if _estimate_tokens(sent) <= budget else (sent[:budget], sent[budget:])
+                pieces.append(head)
+
+    chunks, current, used = [], [], 0
+    for piece in pieces:
+        cost = _estimate_tokens(piece)
+        if current and used + cost > budget:
+            chunks.append("\n".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += cost
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _merge_chunk_results(results: list[tuple[str, list[DisasterInfo]]]) -> tuple[str, list[DisasterInfo]]:
+    """按块顺序拼接摘要，四元组按 (时间, 地点, 事件, 受灾程度) 完全相同去重"""
+    summary = "".join(s.strip() for s, _ in results if s and s.strip())
+    seen = set()
+    infos: list[DisasterInfo] = []
+    for _, chunk_infos in results:
+        for info in chunk_infos:
+            key = (info.time, info.location, info.event, info.level)
+            if key not in seen:
+                seen.add(key)
+                infos.append(info)
+    return summary, infos
+
+
+def generate_report_info(raw_text: str, mode: str = None) -> tuple[str, list[DisasterInfo]]:
+    """
+    从灾情原文生成摘要和四元组，mode 默认取 LLM_EXTRACT_MODE：
+    - two_step：1. 生成摘要 2. 从摘要提取四元组
+    - single：一次调用以 JSON 返回两者；输出解析失败时退回 two_step
+    原文估算超过 CHUNK_TOKEN_BUDGET 时先切块（map），各块并发抽取，再合并摘要并去重四元组（reduce），
+    总耗时取决于最慢的一块而不是整篇文本。
+    """
+    mode = mode or LLM_EXTRACT_MODE
+    started = time.monotonic()
+    chunks = _split_text(raw_text) if _estimate_tokens(raw_text) > CHUNK_TOKEN_BUDGET else [raw_text]
+    if len(chunks) == 1:
+        result, mode = _extract(raw_text, mode)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(CHUNK_CONCURRENCY, len(chunks)))) as pool:
+            parts = list(pool.map(lambda chunk: _extract(chunk, mode), chunks))
+        result = _merge_chunk_results([r for r, _ in parts])
+        mode = f"{mode} x{len(chunks)} chunks"
+    print(f"[报告抽取] mode={mode}，用时 {time.monotonic() - started:.2f}s，四元组 {len(result[1])} 条")
+    return result
+
+def _judge_similarity(text1: str, text2: str) -> Optional[bool]:
+    """
+    调用 LLM 判断两条灾情是否属于相同事件；调用失败返回 None
     """
     sim_prompt = (
         "你是一个灾害信息比对助手。请判断用户输入的两段四元组文本是否语义相似，"
@@ -157,7 +504,79 @@ def llm_check_similarity(text1: str, text2: str) -> bool:
         return result.strip() == "是"
     except Exception as e:
         print(f"[LLM相似度判断异常] {e}")
+        return None
+
+
+def llm_check_similarity(text1: str, text2: str) -> bool:
+    """
+    判断两条灾情是否属于相同事件。
+    先查判定缓存（与文本顺序无关）；调用异常时返回 False 但不写入缓存，下次仍会重新判断。
+    """
+    key = verdict_key(text1, text2, LLM_MODEL, SIM_PROMPT_VERSION)
+    cached = verdict_cache.get(key)
+    if cached is not None:
+        return cached
+
+    verdict = _judge_similarity(text1, text2)
+    if verdict is None:
         return False
+    verdict_cache.put(key, verdict, LLM_MODEL, SIM_PROMPT_VERSION)
+    return verdict
+
+
+def _judge_similarity_batch(pairs: list[tuple[str, str]]) -> list[Optional[bool]]:
+    """
+    一次请求判断多对四元组文本，返回与 pairs 等长的列表；没解析出结论的位置为 None
+    """
+    sim_prompt = (
+        "你是一个灾害信息比对助手。用户会给出若干组编号的四元组文本对，请逐组判断两段文本是否语义相似。\n"
+        "每组输出一行，格式为“编号: 是”或“编号: 否”，按编号顺序输出，不要添加其他内容。"
+    )
+    user_prompt = "".join(
+        f"{i}.\n文本一：{t1}\n文本二：{t2}\n" for i, (t1, t2) in enumerate(pairs, 1)
+    ) + "请逐组回答，每行一个“编号: 是/否”。"
+
+    sim_messages = [
+        {"role": "system", "content": sim_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    verdicts: list[Optional[bool]] = [None] * len(pairs)
+    try:
+        result = _call_chat_llm(sim_messages, max_tokens=8 * len(pairs) + 16, temperature=0.0)
+    except Exception as e:
+        print(f"[LLM批量相似度判断异常] {e}")
+        return verdicts
+    for m in _BATCH_VERDICT_RE.finditer(result):
+        idx = int(m.group(1)) - 1
+        if 0 <= idx < len(pairs) and verdicts[idx] is None:
+            verdicts[idx] = m.group(2) == "是"
+    return verdicts
+
+
+def llm_check_similarity_batch(pairs: list[tuple[str, str]], batch_size: int = SIM_BATCH_SIZE) -> list[bool]:
+    """
+    批量版 llm_check_similarity：缓存未命中的文本对按 batch_size 个一组编号后放进同一次请求，
+    解析不出结论的文本对再退回单对调用。返回与 pairs 顺序一致的判定结果。
+    """
+    results: list[Optional[bool]] = [None] * len(pairs)
+    keys = [verdict_key(t1, t2, LLM_MODEL, SIM_PROMPT_VERSION) for t1, t2 in pairs]
+    pending = []
+    for i, key in enumerate(keys):
+        results[i] = verdict_cache.get(key)
+        if results[i] is None:
+            pending.append(i)
+
+    batch_size = max(1, batch_size)
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        verdicts = _judge_similarity_batch([pairs[i] for i in chunk]) if len(chunk) > 1 else [None]
+        for i, verdict in zip(chunk, verdicts):
+            if verdict is None:
+                results[i] = llm_check_similarity(*pairs[i])
+            else:
+                verdict_cache.put(keys[i], verdict, LLM_MODEL, SIM_PROMPT_VERSION)
+                results[i] = verdict
+    return results
     
 def merge_level_texts(level_lines: list[str]) -> str:
     """
@@ -0,0 +1,101 @@
+# app/core/verdict_cache.py
+
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.db.session import SessionLocal
+from app.models.llm_verdict import LLMVerdict
+
+VERDICT_CACHE_SIZE = int(os.getenv("LLM_VERDICT_CACHE_SIZE", "10000"))
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def verdict_key(text1: str, text2: str, model: str, prompt_version: str) -> str:
+    """与两段文本顺序无关的缓存键"""
+    a, b = sorted([_normalize(text1), _normalize(text2)])
+    raw = "\x1f".join([model or "", prompt_version, a, b])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _VerdictCache:
+    """
+    LLM 相似度判定结果缓存：进程内 LRU 在前，llm_verdicts 表在后。
+    只缓存模型给出的明确结论，调用异常不会写入。
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, value: bool):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bool]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+        db = SessionLocal()
+        try:
+            row = db.get(LLMVerdict, key)
+            value = None if row is None else row.is_similar
+        except SQLAlchemyError as e:
+            print(f"[LLM判定缓存读取异常] {e}")
+            value = None
+        finally:
+            db.close()
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.db_hits += 1
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: bool, model: str, prompt_version: str):
+        self._remember(key, value)
+        db = SessionLocal()
+        try:
+            db.merge(LLMVerdict(cache_key=key, is_similar=value, model=model, prompt_version=prompt_version))
+            db.commit()
+        except SQLAlchemyError as e:
+            # 写库失败只影响持久化，内存中的结论仍然有效
+            db.rollback()
+            print(f"[LLM判定缓存写入异常] {e}")
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+            }
+
+
+verdict_cache = _VerdictCache(VERDICT_CACHE_SIZE)
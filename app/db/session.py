@@ -1,6 +1,6 @@
 # app/db/session.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from app.db.base import Base
 from dotenv import load_dotenv
@@ -24,6 +24,57 @@ def get_db():
     finally:
         db.close()
 
+# create_all 不会给已存在的表加列：后续版本新增的列在这里登记 (列名, DDL, 索引)，启动时补齐。
+# 索引：False 不建，True 建普通索引，"unique" 建唯一索引
+_ADDED_COLUMNS = {
+    "reports": [
+        ("status", "VARCHAR(16) NOT NULL DEFAULT 'done'", False),
+        ("error", "TEXT", False),
+        ("claimed_at", "DATETIME", False),
+        ("text_hash", "VARCHAR(40)", True),
+        ("simhash", "BIGINT", False),
+        ("sim_band0", "INTEGER", True),
+        ("sim_band1", "INTEGER", True),
+        ("sim_band2", "INTEGER", True),
+        ("sim_band3", "INTEGER", True),
+        ("sim_band4", "INTEGER", True),
+        ("sim_band5", "INTEGER", True),
+        ("sim_band6", "INTEGER", True),
+        ("sim_band7", "INTEGER", True),
+        ("duplicate_of", "INTEGER", False),
+    ],
+    "dedup_jobs": [
+        ("active_slot", "INTEGER", "unique"),
+    ],
+}
+
+
+def _has_unique(insp, table: str, column: str) -> bool:
+    constraints = insp.get_unique_constraints(table) + [ix for ix in insp.get_indexes(table) if ix.get("unique")]
+    return any(c["column_names"] == [column] for c in constraints)
+
+
+def _ensure_columns():
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in _ADDED_COLUMNS.items():
+            if not insp.has_table(table):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table)}
+            indexes = {ix["name"] for ix in insp.get_indexes(table)}
+            for name, ddl, index in columns:
+                if name not in existing:
+                    print(f"[数据库] 为 {table} 添加列 {name}")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+                # 与模型里 index=True 生成的索引同名，新建的表不会重复创建；
+                # unique=True 的列在新建的表上是表级约束，已有的唯一索引 / 约束都算
+                ix_name = f"ix_{table}_{name}" if index is True else f"uq_{table}_{name}"
+                if not index or ix_name in indexes or (index == "unique" and _has_unique(insp, table, name)):
+                    continue
+                unique = "UNIQUE " if index == "unique" else ""
+                conn.execute(text(f"CREATE {unique}INDEX {ix_name} ON {table} ({name})"))
+
+
 # 运行一次创建所有表（可在入口调用）
 def init_db():
     # 确保所有模型都被加载，才会显示在 metadata 中
@@ -31,5 +82,12 @@ def init_db():
     from app.models.report import Report
     from app.models.disaster_info import DisasterInfo
     from app.models.dedup_log import DedupLog
+    from app.models.disaster_embedding import DisasterEmbedding
+    from app.models.llm_verdict import LLMVerdict
+    from app.models.dedup_job import DedupJob
 
     Base.metadata.create_all(bind=engine)
+    _ensure_columns()
+
+    from app.utils.report_search import ensure_search_index
+    ensure_search_index(engine)
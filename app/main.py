@@ -1,5 +1,6 @@
 # app/main.py
 
+import os
 import uvicorn
 from fastapi import FastAPI
 from dotenv import load_dotenv
@@ -21,6 +22,19 @@ app.add_middleware(
 @app.on_event("startup")
 def on_startup():
     init_db()
+    # 补跑上次退出前尚未完成后台抽取的报告
+    from app.utils.ingest_worker import resume_pending_reports
+    resume_pending_reports()
+    # 嵌入模型默认在首次去重/编码时才加载；专门跑去重的实例可设 EMBEDDER_WARMUP=1 在启动时预热
+    if os.getenv("EMBEDDER_WARMUP") == "1":
+        from app.utils.embedder import warmup
+        warmup()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    from app.core.llm_service import close_llm_clients
+    close_llm_clients()
 
 # 路由注册
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
@@ -0,0 +1,24 @@
+# app/models/dedup_job.py
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON
+from datetime import datetime
+from app.db.base import Base
+
+class DedupJob(Base):
+    __tablename__ = "dedup_jobs"
+
+    id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False, default="pending")  # pending / running / done / failed / cancelled
+    stage = Column(String(32), nullable=False, default="queued")    # 当前阶段：encoding / searching / llm / merging ...
+    processed = Column(Integer, nullable=False, default=0)          # 当前阶段已处理数量
+    total = Column(Integer, nullable=False, default=0)              # 当前阶段总数
+    llm_pending = Column(Integer, nullable=False, default=0)        # 尚未返回的 LLM 复核数
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    # 进行中的任务固定为 1、结束后置空；唯一约束保证跨 worker 进程同一时刻至多一个进行中的任务
+    active_slot = Column(Integer, unique=True)
+    error = Column(Text)
+    result = Column(JSON)                                           # 完成后的统计与 cluster_details
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    stage_started_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime)
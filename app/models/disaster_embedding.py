@@ -0,0 +1,12 @@
+# app/models/disaster_embedding.py
+from app.db.base import Base
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary
+
+
+class DisasterEmbedding(Base):
+    __tablename__ = "disaster_embeddings"
+
+    # 与 disaster_infos 一对一，按记录 id 存储融合后的向量
+    info_id = Column(Integer, ForeignKey("disaster_infos.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String(64), nullable=False)  # time/location/event/level 的内容哈希
+    vector = Column(LargeBinary, nullable=False)       # float32 原始字节
@@ -0,0 +1,14 @@
+# app/models/llm_verdict.py
+from sqlalchemy import Column, String, Boolean, DateTime
+from datetime import datetime
+from app.db.base import Base
+
+class LLMVerdict(Base):
+    __tablename__ = "llm_verdicts"
+
+    # 两段四元组文本（规范化、排序后）+ 模型名 + 提示词版本 的哈希
+    cache_key = Column(String(64), primary_key=True)
+    is_similar = Column(Boolean, nullable=False)
+    model = Column(String(128))
+    prompt_version = Column(String(16), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
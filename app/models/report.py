@@ -1,6 +1,6 @@
 # app/models/report.py
 from app.db.base import Base
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text
 from sqlalchemy.orm import relationship 
 
 
@@ -11,10 +11,28 @@ class Report(Base):
     text = Column(Text, nullable=False)       # 用户原始上报文本
     summary = Column(Text, nullable=False)    # 模型生成的摘要
     created_at = Column(DateTime, nullable=False)
+    # 抽取状态：pending（已入库待抽取）/ processing / done / failed；同步上报直接为 done
+    status = Column(String(16), nullable=False, default="done", server_default="done")
+    error = Column(Text)                      # 抽取失败原因
+    claimed_at = Column(DateTime)             # 后台抽取的认领时间（租约起点）
+
+    # 原文指纹（见 app/utils/near_dup.py）：规范化文本的哈希 + 64 位 SimHash 及其 8 个 8 位分段（LSH 桶）
+    text_hash = Column(String(40), index=True)
+    simhash = Column(BigInteger)
+    sim_band0 = Column(Integer, index=True)
+    sim_band1 = Column(Integer, index=True)
+    sim_band2 = Column(Integer, index=True)
+    sim_band3 = Column(Integer, index=True)
+    sim_band4 = Column(Integer, index=True)
+    sim_band5 = Column(Integer, index=True)
+    sim_band6 = Column(Integer, index=True)
+    sim_band7 = Column(Integer, index=True)
+    # 与某条已有报告原文（近似）重复时，复用其摘要与四元组并记录被复用报告的 id
+    duplicate_of = Column(Integer)
 
     # 关系字段：四元组
     disaster_infos = relationship(
         "DisasterInfo",
         back_populates="report",
-        cascade="all, delete",
+        cascade="all, delete-orphan",
     )
\ No newline at end of file
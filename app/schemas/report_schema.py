@@ -2,7 +2,7 @@
 from pydantic import BaseModel
 from datetime import datetime
 from app.schemas.disaster_info_schema import DisasterInfoOut
-from typing import List
+from typing import List, Optional
 
 class ReportCreate(BaseModel):
     text: str  # 用户上报的长文本
@@ -14,13 +14,30 @@ class ReportOut(BaseModel):
     summary: str
     disaster_infos: list[DisasterInfoOut] 
     created_at: datetime
+    status: str = "done"
+    error: Optional[str] = None
+    duplicate_of: Optional[int] = None   # 原文重复时被复用的报告 id
 
     class Config:
         from_attributes = True
 
+class ReportStatusOut(BaseModel):
+    report_id: int
+    status: str
+    error: Optional[str] = None
+
 class ReportListOut(BaseModel):
     items: List[ReportOut]
-    total: int
+    total: Optional[int] = None        # with_total=false 时不计算
+    next_cursor: Optional[str] = None  # 下一页的键集分页游标，没有下一页时为 null
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class SemanticReportOut(ReportOut):
+    similarity: float  # 报告内与查询最相近的四元组的相似度
+
+class SemanticReportListOut(BaseModel):
+    items: List[SemanticReportOut]
+    total: int
+    next_cursor: Optional[str] = None
@@ -0,0 +1,78 @@
+# app/utils/blocking.py
+
+import os
+import re
+from typing import Optional, Tuple
+
+# 时间为“未知”（或解析不出年份）的记录如何分块：
+#   any  —— 与同类事件的任意时间记录都可比对（默认，宁可多比不漏判）
+#   same —— 只与同样时间未知的记录比对
+UNKNOWN_TIME_RULE = os.getenv("DEDUP_UNKNOWN_TIME", "any")
+# 月份桶的容差：相差不超过该月数的记录视为时间兼容（跨月上报、月底月初的事件）
+MONTH_TOLERANCE = int(os.getenv("DEDUP_MONTH_TOLERANCE", "1"))
+
+# 事件归类：同一类别内的不同说法视为同类事件
+_EVENT_CATEGORIES = [
+    ("台风", ("台风", "热带风暴", "热带低压", "飓风")),
+    ("洪涝", ("洪水", "洪涝", "内涝", "暴雨", "强降雨", "降雨", "积水", "山洪")),
+    ("地震", ("地震", "余震")),
+    ("地质灾害", ("山体滑坡", "滑坡", "泥石流", "崩塌", "塌方", "地面塌陷")),
+    ("干旱", ("干旱", "旱情", "旱灾")),
+    ("火灾", ("火灾", "山火", "森林火灾", "起火")),
+    ("低温冰冻", ("寒潮", "冰冻", "暴雪", "雪灾", "低温", "冰雹")),
+    ("风灾", ("大风", "龙卷风", "雷暴", "强对流")),
+]
+_UNKNOWN_VALUES = {"", "未知", "不详", "无"}
+
+_YEAR_MONTH_RE = re.compile(r"(\d{4})\s*(?:年|-|/|\.)\s*(\d{1,2})")
+_YEAR_RE = re.compile(r"(\d{4})\s*年?")
+
+# (年, 月)；月份未知时为 (年, None)；整个时间未知时为 None
+TimeBucket = Optional[Tuple[int, Optional[int]]]
+BlockKey = Tuple[Optional[str], TimeBucket]
+
+
+def event_category(event: str) -> Optional[str]:
+    """事件归一化为类别；未知事件返回 None（与任意类别兼容）"""
+    text = (event or "").strip()
+    if text in _UNKNOWN_VALUES:
+        return None
+    for category, keywords in _EVENT_CATEGORIES:
+        if any(k in text for k in keywords):
+            return category
+    return text
+
+
+def time_bucket(time: str) -> TimeBucket:
+    """从自由文本时间中解析出粗粒度的 (年, 月) 桶"""
+    text = (time or "").strip()
+    m = _YEAR_MONTH_RE.search(text)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return int(m.group(1)), int(m.group(2))
+    m = _YEAR_RE.search(text)
+    if m:
+        return int(m.group(1)), None
+    return None
+
+
+def block_key(record) -> BlockKey:
+    return event_category(record.event), time_bucket(record.time)
+
+
+def events_compatible(a: Optional[str], b: Optional[str]) -> bool:
+    return a is None or b is None or a == b
+
+
+def times_compatible(a: TimeBucket, b: TimeBucket) -> bool:
+    if a is None or b is None:
+        if UNKNOWN_TIME_RULE == "same":
+            return a is None and b is None
+        return True
+    (ya, ma), (yb, mb) = a, b
+    if ma is None or mb is None:
+        return ya == yb
+    return abs((ya * 12 + ma) - (yb * 12 + mb)) <= MONTH_TOLERANCE
+
+
+def blocks_compatible(a: BlockKey, b: BlockKey) -> bool:
+    return events_compatible(a[0], b[0]) and times_compatible(a[1], b[1])
@@ -0,0 +1,212 @@
+# app/utils/bulk_ingest.py
+
+import csv
+import datetime
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional, Tuple
+
+from app.db.session import SessionLocal
+from app.models.report import Report
+from app.core.llm_service import generate_report_info
+from app.utils.report_search import sync_reports
+from app.utils.semantic_search import index_infos
+from app.utils.near_dup import NEAR_DUP_ENABLED, find_duplicate, link_duplicate, set_fingerprint
+
+# 批量导入时 LLM 抽取的默认 / 最大并发数，以及每个事务写入的报告条数（默认 / 最大）。
+# 结果事件在写库后才产出，批次过大时内存里积压的抽取结果变多、进度也迟迟不更新，因此同样设上限
+BULK_CONCURRENCY = int(os.getenv("BULK_INGEST_CONCURRENCY", "4"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_INGEST_MAX_CONCURRENCY", "16"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", "50"))
+BULK_MAX_BATCH_SIZE = int(os.getenv("BULK_INGEST_MAX_BATCH_SIZE", "200"))
+
+SUPPORTED_FORMATS = ("jsonl", "csv", "xlsx")
+# CSV / xlsx 中作为原文的列名（按顺序匹配表头）；都没有时取第一列
+TEXT_COLUMNS = ("text", "原文", "内容", "灾情文本")
+
+# 长灾情文本可能超过 csv 模块默认的 128KB 单字段上限
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+# (行号, 原文, 解析错误)，原文与错误二者有一
+Row = Tuple[int, Optional[str], Optional[str]]
+
+
+def detect_format(filename: str) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".xlsx"):
+        return "xlsx"
+    return None
+
+
+def _text_column(header) -> int:
+    names = [str(h).strip().lower() if h is not None else "" for h in header]
+    for col in TEXT_COLUMNS:
+        if col in names:
+            return names.index(col)
+    return 0
+
+
+def _iter_jsonl(path: str) -> Iterator[Row]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for row_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                yield row_no, None, f"JSON 解析失败: {e}"
+                continue
+            text = obj.get("text") if isinstance(obj, dict) else obj
+            if not isinstance(text, str):
+                yield row_no, None, "缺少 text 字段"
+                continue
+            yield row_no, text, None
+
+
+def _iter_csv(path: str) -> Iterator[Row]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        col = _text_column(header)
+        for row_no, row in enumerate(reader, 2):
+            yield row_no, row[col] if col < len(row) else "", None
+
+
+def _iter_xlsx(path: str) -> Iterator[Row]:
+    from openpyxl import load_workbook
+
+    # 只读模式按行流式读取，不把整个工作簿载入内存
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        col = _text_column(header)
+        for row_no, row in enumerate(rows, 2):
+            value = row[col] if col < len(row) else None
+            yield row_no, "" if value is None else str(value), None
+    finally:
+        wb.close()
+
+
+def iter_rows(path: str, fmt: str) -> Iterator[Row]:
+    """按格式逐行读取上传文件，产出 (行号, 原文, 解析错误)"""
+    return {"jsonl": _iter_jsonl, "csv": _iter_csv, "xlsx": _iter_xlsx}[fmt](path)
+
+
+def _extract_row(text: str) -> tuple:
+    """
+    抽取一行：原文与近期报告重复时复用其摘要，返回 (summary, infos, 被复用报告 id)；
+    否则调用 LLM，返回 (summary, infos, None)
+    """
+    if NEAR_DUP_ENABLED:
+        db = SessionLocal()
+        try:
+            original = find_duplicate(db, text)
+            if original is not None:
+                return original.summary, [], original.id
+        finally:
+            db.close()
+    summary, infos = generate_report_info(text)
+    return summary, infos, None
+
+
+def _flush(batch: list) -> list[dict]:
+    """一个事务写入一批抽取结果，返回每行的结果事件"""
+    if not batch:
+        return []
+    db = SessionLocal()
+    try:
+        now = datetime.datetime.utcnow()
+        reports = []
+        for _, text, summary, infos, original_id in batch:
+            rpt = Report(text=text, summary=summary, created_at=now, disaster_infos=infos)
+            set_fingerprint(rpt)
+            if original_id is not None:
+                link_duplicate(db, rpt, original_id, summary)
+            reports.append(rpt)
+        db.add_all(reports)
+        db.flush()
+        sync_reports(db, [rpt.id for rpt in reports])
+        db.commit()
+        index_infos([d for rpt in reports for d in rpt.disaster_infos])
+        events = [
+            {
+                "row": row_no,
+                "status": "ok",
+                "report_id": rpt.id,
+                "duplicate_of": rpt.duplicate_of,
+                "info_ids": [d.id for d in rpt.disaster_infos],
+            }
+            for (row_no, *_), rpt in zip(batch, reports)
+        ]
+    except Exception as e:
+        db.rollback()
+        print(f"[批量导入] 写入失败：{e}")
+        events = [{"row": row_no, "status": "failed", "error": f"写入失败: {e}"} for row_no, *_ in batch]
+    finally:
+        db.close()
+    batch.clear()
+    return events
+
+
+def bulk_ingest(rows: Iterator[Row], concurrency: int = BULK_CONCURRENCY, batch_size: int = BULK_BATCH_SIZE) -> Iterator[dict]:
+    """
+    并发抽取并分批入库，逐行产出结果事件：
+    {"row", "status": "ok", "report_id", "info_ids"} / {"row", "status": "failed" | "skipped", "error"}，
+    最后产出一条 {"status": "finished", "ok", "failed", "skipped"} 汇总。
+    在途的抽取请求不超过 2 * concurrency 条，读取文件的进度随抽取进度推进，内存占用与文件大小无关。
+    """
+    concurrency = max(1, min(concurrency, BULK_MAX_CONCURRENCY))
+    batch_size = max(1, min(batch_size, BULK_MAX_BATCH_SIZE))
+    counts = {"ok": 0, "failed": 0, "skipped": 0}
+    batch = []
+
+    def _emit(events):
+        for event in events:
+            counts[event["status"]] += 1
+            yield event
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-ingest") as pool:
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < 2 * concurrency:
+                row = next(rows, None)
+                if row is None:
+                    exhausted = True
+                    break
+                row_no, text, error = row
+                if error:
+                    yield from _emit([{"row": row_no, "status": "failed", "error": error}])
+                elif not text.strip():
+                    yield from _emit([{"row": row_no, "status": "skipped", "error": "原文为空"}])
+                else:
+                    pending[pool.submit(_extract_row, text)] = (row_no, text)
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                row_no, text = pending.pop(future)
+                try:
+                    summary, infos, original_id = future.result()
+                except Exception as e:
+                    yield from _emit([{"row": row_no, "status": "failed", "error": f"模型推理失败: {e}"}])
+                    continue
+                batch.append((row_no, text, summary, infos, original_id))
+            if len(batch) >= batch_size:
+                yield from _emit(_flush(batch))
+
+    yield from _emit(_flush(batch))
+    yield {"status": "finished", **counts}
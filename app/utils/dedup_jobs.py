@@ -0,0 +1,264 @@
+# app/utils/dedup_jobs.py
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.models.dedup_job import DedupJob
+from app.models.dedup_log import DedupLog
+from app.utils.dedup_progress import DedupCancelled, NullProgress
+from app.utils.full_dedup_engine import find_similar_disaster_infos
+from app.utils.merge_engine import merge_duplicate_clusters
+
+ACTIVE_STATUSES = ("pending", "running")
+# 超过该时长没有心跳的“运行中”任务视为已随进程退出，不再阻塞新的去重
+JOB_STALE_SECS = int(os.getenv("DEDUP_JOB_STALE_SECS", "900"))
+# 进度写库的最小间隔，阶段切换时立即写入
+PROGRESS_FLUSH_SECS = 1.0
+# 运行中任务的心跳间隔：独立线程定期刷新 updated_at，不依赖进度汇报是否到来，须远小于 JOB_STALE_SECS
+JOB_HEARTBEAT_SECS = float(os.getenv("DEDUP_JOB_HEARTBEAT_SECS", "30"))
+
+# 本进程内串行化“检查 + 创建任务”，以及去重流水线本身（在线去重也会用到）。
+# 两把锁都只在单个进程内有效，跨 worker 的互斥以数据库为准：
+# 进行中的任务占用 active_slot 唯一约束（见 start_dedup_job），在线去重查任务记录（见 batch_job_active）
+_start_lock = threading.Lock()
+run_lock = threading.Lock()
+# 本进程内运行中任务的最新进度 / 取消标记；写库失败（如 SQLite 正被去重事务占用）时以此为准
+_live: dict[str, dict] = {}
+_cancel_flags: dict[str, threading.Event] = {}
+
+
+class DedupJobConflict(Exception):
+    """已有去重任务在运行"""
+
+    def __init__(self, job_id: str):
+        super().__init__(job_id)
+        self.job_id = job_id
+
+
+def run_dedup_pipeline(db: Session, progress=None) -> dict:
+    """完整的一次去重：查找相似对 -> 合并（含清理孤儿报告）-> 写去重日志"""
+    progress = progress or NullProgress()
+    stats = {}
+    pairs = find_similar_disaster_infos(db, stats=stats, progress=progress)
+    merged, deleted, details = merge_duplicate_clusters(db, pairs, progress=progress)
+
+    # 写入去重日志
+    log = DedupLog(
+        duplicates_detected=len(pairs),
+        merged_clusters=merged,
+        deleted_records=deleted,
+    )
+    db.add(log)
+    db.commit()
+
+    return {
+        "duplicates_detected": len(pairs),
+        "merged_clusters": merged,
+        "deleted_records": deleted,
+        "cluster_details": details,
+        "pruned_pairs": stats.get("pruned_pairs", 0),
+    }
+
+
+class JobProgress(NullProgress):
+    """把引擎汇报的进度写入 dedup_jobs 表（节流），并响应取消请求"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.state = _live.setdefault(job_id, {})
+        self._cancel = _cancel_flags.setdefault(job_id, threading.Event())
+        self._last_flush = 0.0
+        self._last_cancel_check = 0.0
+
+    def update(self, stage: str = None, processed: int = None, total: int = None, llm_pending: int = None):
+        now = datetime.utcnow()
+        new_stage = stage is not None and stage != self.state.get("stage")
+        if new_stage:
+            self.state.update(stage=stage, stage_started_at=now, processed=0, total=0, llm_pending=0)
+        for key, value in (("processed", processed), ("total", total), ("llm_pending", llm_pending)):
+            if value is not None:
+                self.state[key] = value
+        self.state["updated_at"] = now
+        if new_stage or time.monotonic() - self._last_flush >= PROGRESS_FLUSH_SECS:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        _write_job(self.job_id, **self.state)
+
+    def check_cancelled(self):
+        if not self._cancel.is_set() and time.monotonic() - self._last_cancel_check >= PROGRESS_FLUSH_SECS:
+            # 取消请求可能来自其他 worker 进程，只能从库里读到
+            self._last_cancel_check = time.monotonic()
+            db = SessionLocal()
+            try:
+                job = db.get(DedupJob, self.job_id)
+                if job is not None and job.cancel_requested:
+                    self._cancel.set()
+            except SQLAlchemyError:
+                pass
+            finally:
+                db.close()
+        if self._cancel.is_set():
+            raise DedupCancelled(self.job_id)
+
+
+def _write_job(job_id: str, **fields) -> bool:
+    """尽力写入任务状态；失败只打印，不影响去重本身"""
+    db = SessionLocal()
+    try:
+        db.query(DedupJob).filter(DedupJob.id == job_id).update(fields, synchronize_session=False)
+        db.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"[去重任务] 写入进度失败：{e}")
+        return False
+    finally:
+        db.close()
+
+
+def _heartbeat(job_id: str, stop: threading.Event):
+    """
+    任务运行期间定期只写 updated_at。长时间的 LLM 复核、合并等阶段可能很久没有进度汇报，
+    其他 worker 据此判断任务是否仍然存活，避免误判为超时后启动重叠的去重。
+    """
+    while not stop.wait(JOB_HEARTBEAT_SECS):
+        _write_job(job_id, updated_at=datetime.utcnow())
+
+
+def _run_job(job_id: str):
+    progress = JobProgress(job_id)
+    progress.state.update(status="running")
+    _write_job(job_id, status="running", updated_at=datetime.utcnow())
+    stop_heartbeat = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(job_id, stop_heartbeat), daemon=True, name=f"dedup-hb-{job_id[:8]}"
+    ).start()
+    db = SessionLocal()
+    final = {}
+    try:
+        with run_lock:
+            result = run_dedup_pipeline(db, progress)
+        final = {"status": "done", "stage": "done", "result": result, "llm_pending": 0}
+    except DedupCancelled:
+        db.rollback()
+        final = {"status": "cancelled", "stage": "cancelled", "llm_pending": 0}
+    except Exception as e:
+        db.rollback()
+        print(f"[去重任务] {job_id} 失败：{e}")
+        final = {"status": "failed", "error": str(e), "llm_pending": 0}
+    finally:
+        stop_heartbeat.set()
+        db.close()
+        now = datetime.utcnow()
+        # 释放运行名额；写库失败时名额在心跳超时后由下一次启动回收
+        final.update(finished_at=now, updated_at=now, active_slot=None)
+        progress.state.update(final)
+        if _write_job(job_id, **progress.state):
+            _live.pop(job_id, None)
+        _cancel_flags.pop(job_id, None)
+
+
+def batch_job_active(db: Session) -> bool:
+    """数据库中是否有未过期的进行中去重任务，任何 worker 进程发起的都算"""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECS)
+    return db.query(DedupJob.id).filter(
+        DedupJob.status.in_(ACTIVE_STATUSES), DedupJob.updated_at >= cutoff
+    ).first() is not None
+
+
+def start_dedup_job(db: Session) -> DedupJob:
+    """
+    创建并在后台线程中启动一个去重任务。已有未过期的运行中任务时抛出 DedupJobConflict。
+    新任务带 active_slot=1 插入，唯一约束保证不同 worker 进程同时发起时只有一个能插入成功。
+    """
+    with _start_lock:
+        now = datetime.utcnow()
+        # 心跳超时的任务视为已随进程退出：标记失败并释放运行名额（条件更新，多个 worker 同时执行也无妨）
+        db.query(DedupJob).filter(
+            DedupJob.status.in_(ACTIVE_STATUSES),
+            DedupJob.updated_at < now - timedelta(seconds=JOB_STALE_SECS),
+        ).update(
+            {
+                DedupJob.status: "failed",
+                DedupJob.error: "任务心跳超时，视为已中断",
+                DedupJob.finished_at: now,
+                DedupJob.active_slot: None,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        active = (
+            db.query(DedupJob.id)
+            .filter(DedupJob.status.in_(ACTIVE_STATUSES))
+            .order_by(DedupJob.created_at.desc())
+            .first()
+        )
+        if active is not None:
+            raise DedupJobConflict(active.id)
+
+        job = DedupJob(id=uuid.uuid4().hex, status="pending", stage="queued", active_slot=1)
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # 其他 worker 进程抢先创建了任务
+            db.rollback()
+            winner = db.query(DedupJob.id).filter(DedupJob.active_slot == 1).scalar()
+            raise DedupJobConflict(winner or "")
+        db.refresh(job)
+
+    threading.Thread(target=_run_job, args=(job.id,), daemon=True, name=f"dedup-{job.id[:8]}").start()
+    return job
+
+
+def request_cancel(db: Session, job: DedupJob):
+    flag = _cancel_flags.get(job.id)
+    if flag is not None:
+        flag.set()
+    job.cancel_requested = True
+    db.commit()
+
+
+def job_status(job: DedupJob) -> dict:
+    """任务状态快照；本进程内运行的任务优先使用内存中的最新进度"""
+    state = {
+        "status": job.status,
+        "stage": job.stage,
+        "processed": job.processed,
+        "total": job.total,
+        "llm_pending": job.llm_pending,
+        "stage_started_at": job.stage_started_at,
+        "error": job.error,
+        "result": job.result,
+        "finished_at": job.finished_at,
+    }
+    state.update({k: v for k, v in _live.get(job.id, {}).items() if k in state})
+
+    eta_seconds = None
+    if state["status"] == "running" and state["stage_started_at"] and 0 < state["processed"] < state["total"]:
+        elapsed = (datetime.utcnow() - state["stage_started_at"]).total_seconds()
+        eta_seconds = round(elapsed / state["processed"] * (state["total"] - state["processed"]), 1)
+
+    return {
+        "job_id": job.id,
+        "status": state["status"],
+        "stage": state["stage"],
+        "processed": state["processed"],
+        "total": state["total"],
+        "llm_pending": state["llm_pending"],
+        "eta_seconds": eta_seconds,
+        "cancel_requested": job.cancel_requested,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": state["finished_at"].isoformat() if state["finished_at"] else None,
+        "error": state["error"],
+        "result": state["result"],
+    }
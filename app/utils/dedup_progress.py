@@ -0,0 +1,18 @@
+# app/utils/dedup_progress.py
+
+
+class DedupCancelled(Exception):
+    """去重任务被管理员取消"""
+
+
+class NullProgress:
+    """
+    去重进度回调的默认实现：什么都不做。
+    后台任务传入 app/utils/dedup_jobs.py 中的 JobProgress，引擎在各阶段调用这些钩子汇报进度、检查取消。
+    """
+
+    def update(self, stage: str = None, processed: int = None, total: int = None, llm_pending: int = None):
+        pass
+
+    def check_cancelled(self):
+        pass
@@ -1,23 +1,207 @@
 # app/utils/embedder.py
-from text2vec import SentenceModel
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
 from app.models.disaster_info import DisasterInfo
 import numpy as np
 
-#加载本地轻量级别模型计算embedding
-model = SentenceModel("./sim_model/text2vec-base-chinese")
+MODEL_PATH = "./sim_model/text2vec-base-chinese"
+# local：进程内加载模型；remote：交给 app/utils/embedding_service.py 独立进程编码
+EMBED_MODE = os.getenv("EMBED_MODE", "local")
+
+# 本地轻量级别模型计算embedding。torch / transformers / text2vec 体积大、加载慢，
+# 首次编码时才导入并加载，只处理查询、登录的 worker 不会为此付出启动时间和内存
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from text2vec import SentenceModel
+                _model = SentenceModel(MODEL_PATH)
+    return _model
+
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        from app.utils.embedding_service import EmbeddingClient
+        _client = EmbeddingClient()
+    return _client
+
+
+def _encode_raw(texts: list[str], batch_size: int) -> np.ndarray:
+    """不经缓存直接编码，按 EMBED_MODE 选择进程内模型或独立嵌入服务"""
+    if EMBED_MODE == "remote":
+        return _get_client().encode(texts)
+    return np.asarray(get_model().encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+def embedding_dimension() -> int:
+    if EMBED_MODE == "remote":
+        return _get_client().dimension()
+    return get_model().get_sentence_embedding_dimension()
+
+
+def warmup():
+    """显式预热：提前加载模型（或连上嵌入服务）并跑一次编码，避免首个去重请求承担加载耗时"""
+    _encode_raw(["预热"], batch_size=1)
+
+
+# 各字段融合权重：时间、地点、事件、受灾程度
+FIELD_WEIGHTS = np.array([0.3, 0.25, 0.2, 0.25], dtype=np.float32)
+DEFAULT_BATCH_SIZE = 256
+
+# 字段文本级缓存：内存 LRU 条数上限；配置路径后再加一层本地 SQLite 持久化，重启后仍可命中
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """缓存键：全角转半角、去首尾空白、合并连续空白"""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+class _EmbeddingCache:
+    """
+    字段文本 -> 向量 的有界 LRU 缓存，可选 SQLite 磁盘层。
+    event、level 以及“未知”这类占位值大量重复，命中后无需再过一遍 transformer。
+    """
+
+    def __init__(self, maxsize: int, path: str = ""):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS field_embeddings (model TEXT, text TEXT, vector BLOB, PRIMARY KEY (model, text))"
+            )
+            self._disk.commit()
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._data[key] = vec
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, keys: list[str]) -> dict:
+        found = {}
+        with self._lock:
+            for k in keys:
+                vec = self._data.get(k)
+                if vec is not None:
+                    self._data.move_to_end(k)
+                    found[k] = vec
+            self.hits += len(found)
+            rest = [k for k in keys if k not in found]
+            if rest and self._disk is not None:
+                for start in range(0, len(rest), 500):
+                    chunk = rest[start:start + 500]
+                    rows = self._disk.execute(
+                        f"SELECT text, vector FROM field_embeddings WHERE model = ? AND text IN ({','.join('?' * len(chunk))})",
+                        [MODEL_PATH, *chunk],
+                    ).fetchall()
+                    for text, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32)
+                        found[text] = vec
+                        self._remember(text, vec)
+                        self.disk_hits += 1
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        with self._lock:
+            for k, vec in items.items():
+                self._remember(k, vec)
+            if self._disk is not None:
+                self._disk.executemany(
+                    "INSERT OR REPLACE INTO field_embeddings (model, text, vector) VALUES (?, ?, ?)",
+                    [(MODEL_PATH, k, v.tobytes()) for k, v in items.items()],
+                )
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = _EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_PATH)
+
+
+def embedding_cache_stats() -> dict:
+    return _cache.stats()
+
+
+def encode_texts(texts: list[str], batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    编码一组文本，返回 (N, dim) float32 矩阵。先按规范化文本去重并查缓存，只有未命中的文本才送入模型。
+    """
+    if not texts:
+        return np.zeros((0, embedding_dimension()), dtype=np.float32)
+    keys = [normalize_text(t) for t in texts]
+    unique = list(dict.fromkeys(keys))
+    found = _cache.get_many(unique)
+    missing = [k for k in unique if k not in found]
+    if missing:
+        fresh = _encode_raw(missing, batch_size)
+        # 逐行拷贝：行视图会让缓存条目一直引用整块批次矩阵，淘汰单条也释放不了内存
+        new_items = {k: vec.copy() for k, vec in zip(missing, fresh)}
+        _cache.put_many(new_items)
+        found.update(new_items)
+    return np.vstack([found[k] for k in keys])
+
+
+def _field_texts(item) -> list[str]:
+    return [item.time or "", item.location or "", item.event or "", item.level or ""]
+
 
 def encode_disaster_fields(item: DisasterInfo):
     """
     对单个灾情记录的各字段分别编码，再加权融合生成最终向量。防止其他噪声影响小模型判别
     """
-    vec_time = model.encode(item.time or "")
-    vec_loc = model.encode(item.location or "")
-    vec_event = model.encode(item.event or "")
-    vec_level = model.encode(item.level or "")
-    final_vector = (
-        0.3 * vec_time +
-        0.25 * vec_loc +
-        0.2 * vec_event +
-        0.25 * vec_level
-    )
-    return final_vector
+    return encode_disaster_batch([item])[0]
+
+
+def encode_disaster_batch(records, batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    批量版 encode_disaster_fields：一次性收集所有记录的四个字段文本，按 batch_size 分批送入模型，
+    再用一次向量化运算完成加权融合。返回形状为 (N, dim) 的 float32 矩阵，行顺序与 records 一致。
+    """
+    records = list(records)
+    if not records:
+        return encode_texts([])
+
+    # 按字段排列：[全部 time, 全部 location, 全部 event, 全部 level]
+    texts = [t for field in zip(*(_field_texts(r) for r in records)) for t in field]
+    emb = encode_texts(texts, batch_size=batch_size)
+    emb = emb.reshape(len(FIELD_WEIGHTS), len(records), -1)
+
+    # (4,) · (4, N, dim) -> (N, dim)
+    return np.tensordot(FIELD_WEIGHTS, emb, axes=1).astype(np.float32, copy=False)
@@ -0,0 +1,190 @@
+# app/utils/embedding_service.py
+
+"""
+独立的嵌入编码进程：持有唯一一份 SentenceModel，通过 Unix socket 接收各 API worker / 去重任务的编码请求，
+把同一时间窗口内到达的请求合并成微批次统一编码。
+
+启动：EMBED_SERVICE_AUTHKEY=<随机密钥> python -m app.utils.embedding_service
+客户端：设置 EMBED_MODE=remote 及同一个 EMBED_SERVICE_AUTHKEY 后，app/utils/embedder.py 会通过 EmbeddingClient 调用本服务。
+
+连接上传输的是 pickle，能连上并通过认证即可在对端执行任意代码，因此：
+- 密钥必须显式配置，未配置时服务拒绝启动、客户端拒绝连接；
+- socket 放在仅当前用户可访问（0700）的目录中，目录属主或权限不符时拒绝使用。
+"""
+
+import os
+import queue
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+# socket 所在目录默认为 $XDG_RUNTIME_DIR（通常是 /run/user/<uid>），否则为临时目录下按用户区分的私有子目录
+_DEFAULT_DIR = os.getenv("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"disaster_embed-{os.getuid()}")
+EMBED_SERVICE_ADDR = os.getenv("EMBED_SERVICE_ADDR", os.path.join(_DEFAULT_DIR, "disaster_embed.sock"))
+EMBED_SERVICE_AUTHKEY = os.getenv("EMBED_SERVICE_AUTHKEY", "").encode("utf-8")
+# 单个微批次最多合并的文本条数，以及第一个请求到达后最多等待多久凑批
+MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "256"))
+MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "10"))
+
+
+class _Pending:
+    """排队中的一次编码请求"""
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+
+
+def _batch_loop(model, q: "queue.Queue[_Pending]"):
+    while True:
+        batch = [q.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + MAX_WAIT_MS / 1000
+        while size < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item.texts)
+
+        texts = [t for item in batch for t in item.texts]
+        try:
+            emb = np.asarray(model.encode(texts, batch_size=MAX_BATCH), dtype=np.float32)
+            offset = 0
+            for item in batch:
+                item.result = emb[offset:offset + len(item.texts)]
+                offset += len(item.texts)
+        except Exception as e:
+            print(f"[嵌入服务编码异常] {e}")
+            for item in batch:
+                item.result = RuntimeError(f"embedding service failed: {e}")
+        for item in batch:
+            item.done.set()
+
+
+def _handle_conn(conn, q: "queue.Queue[_Pending]", dim: int):
+    try:
+        while True:
+            op, payload = conn.recv()
+            if op == "dim":
+                conn.send(dim)
+                continue
+            pending = _Pending(list(payload))
+            q.put(pending)
+            pending.done.wait()
+            conn.send(pending.result)
+    except (EOFError, ConnectionError):
+        pass
+    finally:
+        conn.close()
+
+
+def _authkey() -> bytes:
+    if not EMBED_SERVICE_AUTHKEY:
+        raise RuntimeError("未配置 EMBED_SERVICE_AUTHKEY：嵌入服务的连接使用 pickle，必须设置共享密钥")
+    return EMBED_SERVICE_AUTHKEY
+
+
+def _check_private_dir(address: str, create: bool = False):
+    """socket 所在目录必须是当前用户所有、组和其他用户无任何权限的真实目录"""
+    directory = os.path.dirname(os.path.abspath(address))
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"嵌入服务 socket 目录 {directory} 须为当前用户所有且权限为 0700")
+
+
+def _clear_stale_socket(address: str):
+    """地址已被占用时：仍有服务在监听则拒绝启动，只有确认无人监听的残留 socket 才删除"""
+    try:
+        st = os.lstat(address)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise RuntimeError(f"{address} 已存在且不是 socket，拒绝覆盖")
+    try:
+        Client(address, family="AF_UNIX", authkey=_authkey()).close()
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(address)  # 上次异常退出残留的 socket 文件
+        return
+    except Exception:
+        pass  # 能连上但认证失败：另一个服务仍在监听
+    raise RuntimeError(f"{address} 上已有嵌入服务在运行")
+
+
+def serve(address: str = EMBED_SERVICE_ADDR):
+    from app.utils.embedder import get_model
+
+    authkey = _authkey()
+    _check_private_dir(address, create=True)
+    _clear_stale_socket(address)
+
+    model = get_model()
+    dim = model.get_sentence_embedding_dimension()
+    q: "queue.Queue[_Pending]" = queue.Queue()
+    threading.Thread(target=_batch_loop, args=(model, q), daemon=True).start()
+
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        print(f"[嵌入服务] 监听 {address}，max_batch={MAX_BATCH}，max_wait={MAX_WAIT_MS}ms")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # 认证失败等单个连接的问题不影响服务
+                print(f"[嵌入服务] 拒绝连接：{e}")
+                continue
+            threading.Thread(target=_handle_conn, args=(conn, q, dim), daemon=True).start()
+
+
+class EmbeddingClient:
+    """嵌入服务客户端，每个线程持有一条连接，断线时自动重连一次"""
+
+    def __init__(self, address: str = EMBED_SERVICE_ADDR):
+        self.address = address
+        self._local = threading.local()
+        self._dim = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            authkey = _authkey()
+            _check_private_dir(self.address)
+            conn = Client(self.address, family="AF_UNIX", authkey=authkey)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, op: str, payload=None):
+        for attempt in range(2):
+            try:
+                conn = self._conn()
+                conn.send((op, payload))
+                return conn.recv()
+            except (EOFError, ConnectionError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def dimension(self) -> int:
+        if self._dim is None:
+            self._dim = self._request("dim")
+        return self._dim
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        result = self._request("encode", list(texts))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,76 @@
+# app/utils/embedding_store.py
+
+import hashlib
+from typing import Iterable, List
+
+import numpy as np
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from app.models.disaster_embedding import DisasterEmbedding
+from app.utils.embedder import encode_disaster_batch
+
+# SQLite 单条语句的绑定参数有上限，IN 查询按块拆分
+_IN_CHUNK = 500
+
+
+def _chunks(seq: list, size: int = _IN_CHUNK):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def content_hash(item) -> str:
+    """time/location/event/level 四个字段的内容哈希，字段变化即视为向量失效"""
+    raw = "\x1f".join([item.time or "", item.location or "", item.event or "", item.level or ""])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_vectors(db: Session, records) -> np.ndarray:
+    """
+    读取记录的融合向量，返回 (N, dim) 的 float32 矩阵，行顺序与 records 一致。
+    已存储且内容哈希一致的直接复用；缺失或内容已变化的记录批量重新编码并写回（由调用方提交事务）。
+    """
+    records = list(records)
+    if not records:
+        return encode_disaster_batch([])
+
+    hashes = [content_hash(r) for r in records]
+    stored: dict[int, DisasterEmbedding] = {}
+    for chunk in _chunks([r.id for r in records]):
+        for emb in db.query(DisasterEmbedding).filter(DisasterEmbedding.info_id.in_(chunk)):
+            stored[emb.info_id] = emb
+
+    vectors: List[np.ndarray] = [None] * len(records)
+    stale_idx = []
+    for i, (r, h) in enumerate(zip(records, hashes)):
+        emb = stored.get(r.id)
+        if emb is not None and emb.content_hash == h:
+            vectors[i] = np.frombuffer(emb.vector, dtype=np.float32)
+        else:
+            stale_idx.append(i)
+
+    if stale_idx:
+        fresh = encode_disaster_batch([records[i] for i in stale_idx])
+        to_insert, to_update = [], []
+        for row, i in enumerate(stale_idx):
+            vectors[i] = fresh[row]
+            values = {
+                "info_id": records[i].id,
+                "content_hash": hashes[i],
+                "vector": fresh[row].tobytes(),
+            }
+            (to_update if records[i].id in stored else to_insert).append(values)
+        if to_insert:
+            db.execute(insert(DisasterEmbedding), to_insert)
+        if to_update:
+            db.execute(update(DisasterEmbedding), to_update)
+        print(f"[向量存储] 复用 {len(records) - len(stale_idx)} 条，重新编码 {len(stale_idx)} 条")
+
+    return np.vstack(vectors).astype(np.float32, copy=False)
+
+
+def drop_vectors(db: Session, info_ids: Iterable[int]):
+    """删除记录对应的向量（记录被删除或字段被修改时调用），由调用方提交事务"""
+    ids = list(info_ids)
+    for chunk in _chunks(ids):
+        db.execute(delete(DisasterEmbedding).where(DisasterEmbedding.info_id.in_(chunk)))
@@ -2,108 +2,255 @@
 
 from sqlalchemy.orm import Session
 from app.models.disaster_info import DisasterInfo
-from app.utils.embedder import encode_disaster_fields
-import faiss
-import numpy as np
-from app.core.llm_service import llm_check_similarity  
+from app.utils.embedding_store import get_vectors
+from app.utils.vector_index import disaster_index
+from app.utils.blocking import block_key, blocks_compatible, times_compatible
+from app.utils.dedup_progress import DedupCancelled, NullProgress
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.core.llm_service import llm_check_similarity, llm_check_similarity_batch, SIM_BATCH_SIZE
 
-def find_similar_disaster_infos(db: Session, threshold=0.9, fuzzy_lower=0.6):
+# 模糊对 LLM 复核的最大并发请求数
+LLM_MAX_INFLIGHT = int(os.getenv("DEDUP_LLM_CONCURRENCY", "8"))
+# 流式加载新记录时每批取回的行数
+LOAD_CHUNK = int(os.getenv("DEDUP_LOAD_CHUNK", "2000"))
+# 是否启用按事件类别 + 时间桶的分块比对
+BLOCKING_ENABLED = os.getenv("DEDUP_BLOCKING", "1") == "1"
+# 新-旧检索时的过采样倍数：多取近邻，过滤掉不兼容分块后仍尽量保留 top_k 个候选
+BLOCKING_OVERSAMPLE = int(os.getenv("DEDUP_BLOCKING_OVERSAMPLE", "4"))
+
+
+# 比对只需要这几列，按元组加载，不构造 ORM 对象
+_RECORD_COLUMNS = (
+    DisasterInfo.id,
+    DisasterInfo.time,
+    DisasterInfo.location,
+    DisasterInfo.event,
+    DisasterInfo.level,
+)
+
+
+def _chunks(seq: list, size: int = 500):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _format_record(r) -> str:
+    return f"时间：{r.time}，地点：{r.location}，事件：{r.event}，受灾程度：{r.level}"
+
+
+def _event_blocks(keys, n: int):
+    """
+    按事件类别划分新-新比对的分块，产出 (成员下标, 查询下标)。
+    事件未知的记录作为通配，加入每个类别分块的成员，并在通配记录之间单独比对一次。
+    """
+    if keys is None:
+        all_idx = list(range(n))
+        yield all_idx, all_idx
+        return
+    groups = defaultdict(list)
+    wildcard = []
+    for i, (category, _) in enumerate(keys):
+        (wildcard if category is None else groups[category]).append(i)
+    for idx in groups.values():
+        yield idx + wildcard, idx
+    if wildcard:
+        yield wildcard, wildcard
+
+
+def _resolve_fuzzy_pairs(fuzzy: list, max_workers: int, batch_size: int = SIM_BATCH_SIZE, progress=None) -> list:
+    """
+    并发复核模糊对，fuzzy 为 [(text1, text2), ...]。
+    多于一对时按 batch_size 分组走批量判定（一次请求判多对），各组之间并发执行；
+    返回与输入顺序一致的判定结果列表，保证结果与串行执行相同。
+    每完成一组汇报一次进度并检查取消；取消时不再发起新的请求，已在途的请求会等其返回。
+    """
+    progress = progress or NullProgress()
+    if not fuzzy:
+        return []
+    progress.update(stage="llm", processed=0, total=len(fuzzy), llm_pending=len(fuzzy))
+    if len(fuzzy) == 1:
+        verdicts = [llm_check_similarity(*fuzzy[0])]
+        progress.update(processed=1, llm_pending=0)
+        return verdicts
+    batch_size = max(1, batch_size)
+    chunks = [fuzzy[i:i + batch_size] for i in range(0, len(fuzzy), batch_size)]
+    print(f"Invoking LLM for {len(fuzzy)} fuzzy pairs in {len(chunks)} batches (max in-flight {max_workers})")
+    results = [None] * len(chunks)
+    resolved = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(llm_check_similarity_batch, chunk, batch_size): k
+            for k, chunk in enumerate(chunks)
+        }
+        try:
+            for future in as_completed(futures):
+                k = futures[future]
+                results[k] = future.result()
+                resolved += len(chunks[k])
+                progress.update(processed=resolved, llm_pending=len(fuzzy) - resolved)
+                progress.check_cancelled()
+        except DedupCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    return [verdict for chunk_result in results for verdict in chunk_result]
+
+
+def find_similar_disaster_infos(
+    db: Session,
+    threshold=0.9,
+    fuzzy_lower=0.6,
+    llm_workers=LLM_MAX_INFLIGHT,
+    blocking=BLOCKING_ENABLED,
+    stats: dict = None,
+    progress=None,
+):
     """
     在数据库中查找相似的灾情记录。
     
     1. 先将记录分为“新记录”（has_been_checked=False）和“历史记录”（has_been_checked=True）。
     2. 对新记录内部进行比对（新-新），以及新记录与历史记录间的比对（新-旧）。
+       启用 blocking 时只在事件类别、时间桶兼容的记录之间比对（见 app/utils/blocking.py）。
        对于模糊匹配（相似度在 [fuzzy_lower, threshold) 范围内）时，调用 llm_check_similarity 进行复核。
+       模糊对先全部收集，再以最多 llm_workers 个并发请求统一复核，最后按发现顺序应用判定结果。
     3. 当判断为重复时，取 ID 较小的记录为主记录.
-    4. 比对结束后，将所有新记录的 has_been_checked 设为 True，并提交更新。
+    4. 比对结束后，用批量 UPDATE 将所有新记录的 has_been_checked 设为 True，并提交更新。
+    记录只按列以元组形式分块流式加载，LLM 复核所需的文本只为进入模糊区间的候选对构造。
     
     返回一个包含重复对的列表，每个元素为 (id1, id2) 的元组。
+    传入 stats 字典时会写入本次运行的统计：新记录数、模糊对数、被分块剪掉的候选对数。
+    传入 progress（见 app/utils/dedup_progress.py）时按阶段汇报进度；提交前若收到取消请求，
+    抛出 DedupCancelled 并回滚，新记录保持未比对状态。
     """
-    # 查询所有记录
-    all_records = db.query(DisasterInfo).all()
-    # 分组：新记录和历史记录
-    new_records = [r for r in all_records if not r.has_been_checked]
-    old_records = [r for r in all_records if r.has_been_checked]
+    import faiss  # 延迟导入，避免 API 进程启动时加载
+
+    # 只加载新记录；历史记录由常驻向量索引负责检索
+    progress = progress or NullProgress()
+    new_records = list(
+        db.query(*_RECORD_COLUMNS)
+        .filter(DisasterInfo.has_been_checked == False)
+        .order_by(DisasterInfo.id)
+        .yield_per(LOAD_CHUNK)
+    )
+    progress.update(stage="encoding", processed=0, total=len(new_records))
     
     seen = set()  # 用于去重的记录对（存储排序后的 (id1, id2)）
-    similar_pairs = []
+    # 按发现顺序记录候选对：(pair, None) 为直接判重，(pair, k) 表示等待第 k 个模糊对的 LLM 结论
+    candidates = []
+    fuzzy = []  # [(text1, text2), ...]
+    pruned = set()  # 相似度已达 fuzzy_lower、但因分块不兼容而跳过的候选对（排序后的 (id1, id2)，两个方向只算一次）
 
-    # 为方便 llm 检查，构造文本表示列表
-    new_text_list = [
-        f"时间：{r.time}，地点：{r.location}，事件：{r.event}，受灾程度：{r.level}"
-        for r in new_records
-    ]
-    old_text_list = [
-        f"时间：{r.time}，地点：{r.location}，事件：{r.event}，受灾程度：{r.level}"
-        for r in old_records
-    ]
+    def _collect(rec_a, rec_b, score):
+        pair = tuple(sorted([rec_a.id, rec_b.id]))
+        if pair in seen:
+            return
+        seen.add(pair)
+        if score >= threshold:
+            candidates.append((pair, None))
+        elif fuzzy_lower <= score < threshold:
+            candidates.append((pair, len(fuzzy)))
+            fuzzy.append((_format_record(rec_a), _format_record(rec_b)))
     
-    # 新记录之间（新-新）的比对
+    # 新记录之间（新-新）的比对：按事件类别分块建索引，时间桶在检索后过滤
     if new_records:
-        vectors_new = np.array([encode_disaster_fields(r) for r in new_records])
+        vectors_new = get_vectors(db, new_records)
+        # 立即提交补算的向量：向量按内容哈希复用，提前落盘不影响取消语义；
+        # 否则写事务会一直持有到 LLM 复核结束，SQLite 下判定缓存、任务进度等其他会话的写入全部被锁住
+        db.commit()
         faiss.normalize_L2(vectors_new)
-        index_new = faiss.IndexFlatIP(vectors_new.shape[1])
-        index_new.add(vectors_new)
+        progress.update(stage="searching", processed=0, total=len(new_records))
+        progress.check_cancelled()
+        keys_new = [block_key(r) for r in new_records] if blocking else None
         top_k = 5
-        scores_new, neighbors_new = index_new.search(vectors_new, top_k)
-        
-        for i, (score_row, neighbor_row) in enumerate(zip(scores_new, neighbors_new)):
-            for j, score in enumerate(score_row):
-                target_idx = neighbor_row[j]
-                if i == target_idx or target_idx < 0 or target_idx >= len(new_records):
-                    continue  # 加索引保护
-                pair = tuple(sorted([new_records[i].id, new_records[target_idx].id]))
-                if pair in seen:
-                    continue
-                seen.add(pair)
-                if score >= threshold:
-                    similar_pairs.append(pair)
-                    # 较小 id 为主记录
-                    main_id, _ = sorted([new_records[i].id, new_records[target_idx].id])
-                    main_record = db.query(DisasterInfo).filter(DisasterInfo.id == main_id).first()
-                elif fuzzy_lower <= score < threshold:
-                    print(f"Invoking LLM for fuzzy new-new comparison: Record {new_records[i].id} vs Record {new_records[target_idx].id}")
-                    if llm_check_similarity(new_text_list[i], new_text_list[target_idx]):
-                        similar_pairs.append(pair)
-                        main_id, _ = sorted([new_records[i].id, new_records[target_idx].id])
-                        main_record = db.query(DisasterInfo).filter(DisasterInfo.id == main_id).first()
+        if keys_new:
+            # 分块后跨事件类别的记录不会被检索到：另做一次不分块的检索，只用于统计被剪掉的候选对
+            index_all = faiss.IndexFlatIP(vectors_new.shape[1])
+            index_all.add(vectors_new)
+            scores_all, neighbors_all = index_all.search(vectors_new, min(top_k, len(new_records)))
+            for i, (score_row, neighbor_row) in enumerate(zip(scores_all, neighbors_all)):
+                for score, j in zip(score_row, neighbor_row):
+                    if j < 0 or j == i or score < fuzzy_lower:
+                        continue
+                    if not blocks_compatible(keys_new[i], keys_new[j]):
+                        pruned.add(tuple(sorted([new_records[i].id, new_records[j].id])))
+        for members, queries in _event_blocks(keys_new, len(new_records)):
+            index_new = faiss.IndexFlatIP(vectors_new.shape[1])
+            index_new.add(vectors_new[members])
+            scores_new, neighbors_new = index_new.search(vectors_new[queries], min(top_k, len(members)))
+
+            for i, score_row, neighbor_row in zip(queries, scores_new, neighbors_new):
+                for score, local_idx in zip(score_row, neighbor_row):
+                    if local_idx < 0 or local_idx >= len(members):
+                        continue  # 加索引保护
+                    target_idx = members[local_idx]
+                    if i == target_idx:
+                        continue
+                    if keys_new and not times_compatible(keys_new[i][1], keys_new[target_idx][1]):
+                        continue
+                    _collect(new_records[i], new_records[target_idx], score)
+            progress.check_cancelled()
 
     # 新记录与历史记录之间（新-旧）的比对
-    if new_records and old_records:
-        vectors_old = np.array([encode_disaster_fields(r) for r in old_records])
-        faiss.normalize_L2(vectors_old)
-        index_old = faiss.IndexFlatIP(vectors_old.shape[1])
-        index_old.add(vectors_old)
+    if new_records:
+        disaster_index.ensure_synced(db)
         top_k = 5
-        for i, record in enumerate(new_records):
-            vec_new = encode_disaster_fields(record)
-            vec_new = vec_new.reshape(1, -1)
-            faiss.normalize_L2(vec_new)
-            scores_old, neighbors_old = index_old.search(vec_new, top_k)
-            for score, target_idx in zip(scores_old[0], neighbors_old[0]):
-                if target_idx < 0 or target_idx >= len(old_records):
-                    continue  # 加索引保护
-                pair = tuple(sorted([record.id, old_records[target_idx].id]))
-                if pair in seen:
+        # 历史索引是全局的，启用分块时多取近邻再过滤掉不兼容的分块
+        search_k = top_k * BLOCKING_OVERSAMPLE if blocking else top_k
+        # 新记录向量已在新-新阶段归一化，这里一次性批量检索历史索引
+        scores_old, neighbors_old = disaster_index.search(vectors_new, search_k)
+        candidate_ids = sorted({int(t) for row in neighbors_old for t in row if t >= 0})
+        old_by_id = {}
+        for chunk in _chunks(candidate_ids):
+            for r in db.query(*_RECORD_COLUMNS).filter(DisasterInfo.id.in_(chunk)):
+                old_by_id[r.id] = r
+        for i, (record, score_row, neighbor_row) in enumerate(zip(new_records, scores_old, neighbors_old)):
+            kept = 0
+            for score, target_id in zip(score_row, neighbor_row):
+                if kept >= top_k:
+                    break
+                old = old_by_id.get(int(target_id))
+                if old is None:
+                    continue  # 空位（-1）或索引中已不存在的记录
+                if keys_new and not blocks_compatible(keys_new[i], block_key(old)):
+                    if score >= fuzzy_lower:
+                        pruned.add(tuple(sorted([record.id, old.id])))
                     continue
-                seen.add(pair)
-                if score >= threshold:
-                    similar_pairs.append(pair)
-                    main_id, _ = sorted([record.id, old_records[target_idx].id])
-                    main_record = db.query(DisasterInfo).filter(DisasterInfo.id == main_id).first()
-                elif fuzzy_lower <= score < threshold:
-                    print(f"Invoking LLM for fuzzy new-new comparison: Record {record.id} vs Record {old_records[target_idx].id}")
-                    text_new = f"时间：{record.time}，地点：{record.location}，事件：{record.event}，受灾程度：{record.level}"
-                    text_old = f"时间：{old_records[target_idx].time}，地点：{old_records[target_idx].location}，事件：{old_records[target_idx].event}，受灾程度：{old_records[target_idx].level}"
-                    if llm_check_similarity(text_new, text_old):
-                        similar_pairs.append(pair)
-                        main_id, _ = sorted([record.id, old_records[target_idx].id])
-                        main_record = db.query(DisasterInfo).filter(DisasterInfo.id == main_id).first()
-                        
+                kept += 1
+                _collect(record, old, score)
+        progress.update(processed=len(new_records))
+
+    # 统一并发复核模糊对，再按发现顺序应用结论
+    try:
+        verdicts = _resolve_fuzzy_pairs(fuzzy, llm_workers, progress=progress)
+        progress.check_cancelled()
+    except DedupCancelled:
+        db.rollback()
+        raise
+    similar_pairs = [
+        pair for pair, fuzzy_idx in candidates
+        if fuzzy_idx is None or verdicts[fuzzy_idx]
+    ]
+
     # ---------------------------
-    # 将所有新记录标记为已比对
-    for rec in new_records:
-        rec.has_been_checked = True
+    # 将所有新记录标记为已比对（按 id 批量 UPDATE，不逐个修改 ORM 对象）
+    for chunk in _chunks([r.id for r in new_records]):
+        db.query(DisasterInfo).filter(DisasterInfo.id.in_(chunk)).update(
+            {DisasterInfo.has_been_checked: True}, synchronize_session=False
+        )
     
     db.commit()
+    # 提交成功后再把新记录增量加入历史索引
+    if new_records:
+        disaster_index.add([r.id for r in new_records], vectors_new)
+
+    if stats is not None:
+        stats.update({
+            "new_records": len(new_records),
+            "fuzzy_pairs": len(fuzzy),
+            "pruned_pairs": len(pruned),
+        })
+    if pruned:
+        print(f"[分块] 跳过 {len(pruned)} 对事件类别或时间不兼容的候选")
     return similar_pairs
@@ -0,0 +1,141 @@
+# app/utils/ingest_worker.py
+
+import os
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import or_
+
+from app.db.session import SessionLocal
+from app.models.report import Report
+from app.core.llm_service import generate_report_info
+from app.utils.online_dedup import STREAMING_ENABLED, check_new_infos
+from app.utils.report_search import sync_reports
+from app.utils.semantic_search import index_infos
+from app.utils.near_dup import NEAR_DUP_ENABLED, find_duplicate, link_duplicate
+
+# 开启后 POST /report/ 默认只落库原文并返回 202，摘要与四元组在后台抽取
+INGEST_ASYNC = os.getenv("REPORT_INGEST_ASYNC", "0") == "1"
+# 后台抽取的最大并发数（同时在途的 LLM 抽取数）
+INGEST_CONCURRENCY = int(os.getenv("REPORT_INGEST_CONCURRENCY", "4"))
+
+# 认领租约：processing 状态超过该时长仍未完成的报告视为认领者已退出，启动补跑时才会重新排队。
+# 须大于单条报告抽取的最长耗时（含 LLM 重试与长文本分块）
+INGEST_LEASE_SECS = int(os.getenv("REPORT_INGEST_LEASE_SECS", "900"))
+
+FINAL_STATUSES = ("done", "failed")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, INGEST_CONCURRENCY), thread_name_prefix="ingest")
+    return _pool
+
+
+def _process_report(report_id: int):
+    """
+    抽取一条待处理报告：先把 pending 原子地改为 processing 并记下认领时间 claimed_at（租约），
+    写回结果时以“状态仍为 processing 且 claimed_at 未变”为条件更新状态；
+    租约过期后被其他 worker 重新认领时，原认领者的结果会被丢弃，不会重复写入。
+    成功后写入摘要与四元组并置为 done，失败置为 failed 并记录原因。
+    """
+    # MySQL 的 DATETIME 不保存微秒，去掉后才能按值比较
+    claim = datetime.utcnow().replace(microsecond=0)
+    db = SessionLocal()
+
+    def _finish(**fields) -> bool:
+        """仍持有认领时把状态改为最终状态；该 UPDATE 在提交前锁住该行，保证结果只写一次"""
+        owned = (
+            db.query(Report)
+            .filter(Report.id == report_id, Report.status == "processing", Report.claimed_at == claim)
+            .update(fields, synchronize_session=False)
+        )
+        if not owned:
+            db.rollback()
+            print(f"[后台抽取] 报告 {report_id} 的认领已失效（已删除或被重新认领），丢弃本次结果")
+        return bool(owned)
+
+    try:
+        claimed = (
+            db.query(Report)
+            .filter(Report.id == report_id, Report.status == "pending")
+            .update({Report.status: "processing", Report.claimed_at: claim}, synchronize_session=False)
+        )
+        db.commit()
+        if not claimed:
+            return
+        rpt = db.get(Report, report_id)
+        if rpt is None:
+            return  # 抽取前已被删除
+        text = rpt.text
+        original = find_duplicate(db, text, exclude_id=report_id) if NEAR_DUP_ENABLED else None
+        if original is not None:
+            original_id, original_summary = original.id, original.summary
+            if not _finish(status="done"):
+                return
+            link_duplicate(db, rpt, original_id, original_summary)
+            db.flush()
+            sync_reports(db, [report_id])
+            db.commit()
+            return
+        try:
+            summary, infos = generate_report_info(text)
+        except Exception as e:
+            print(f"[后台抽取] 报告 {report_id} 失败：{e}")
+            db.rollback()
+            if _finish(status="failed", error=f"模型推理失败: {e}"):
+                db.commit()
+            return
+        if not _finish(status="done", error=None):
+            return
+        rpt.summary, rpt.disaster_infos = summary, infos
+        rpt.status, rpt.error = "done", None
+        db.flush()
+        sync_reports(db, [report_id])
+        db.commit()
+        index_infos(infos)
+        info_ids = [d.id for d in infos]
+    except Exception as e:
+        db.rollback()
+        print(f"[后台抽取异常] 报告 {report_id}：{e}")
+        return
+    finally:
+        db.close()
+
+    if STREAMING_ENABLED:
+        check_new_infos(info_ids)
+
+
+def submit_report(report_id: int):
+    """把已入库的 pending 报告交给后台线程池抽取"""
+    _get_pool().submit(_process_report, report_id)
+
+
+def resume_pending_reports():
+    """
+    启动时补跑尚未抽取的报告。处理中的报告只有认领租约已过期（认领者大概率已退出）才重新排队，
+    其他 worker 仍在抽取的不受影响。
+    """
+    db = SessionLocal()
+    try:
+        expired = datetime.utcnow() - timedelta(seconds=INGEST_LEASE_SECS)
+        db.query(Report).filter(
+            Report.status == "processing",
+            or_(Report.claimed_at.is_(None), Report.claimed_at < expired),
+        ).update({Report.status: "pending"}, synchronize_session=False)
+        db.commit()
+        ids = [row.id for row in db.query(Report.id).filter(Report.status == "pending").order_by(Report.id)]
+    finally:
+        db.close()
+    if ids:
+        print(f"[后台抽取] 补跑 {len(ids)} 条待抽取报告")
+    for report_id in ids:
+        submit_report(report_id)
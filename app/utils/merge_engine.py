@@ -1,11 +1,26 @@
 # app/utils/merge_engine.py
 
+import os
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from sqlalchemy import delete, func, or_, update
 from sqlalchemy.orm import Session
 from typing import List, Tuple
 
 from app.models.disaster_info import DisasterInfo
+from app.models.report import Report
 from app.core.llm_service import merge_level_texts
+from app.utils.embedding_store import get_vectors, drop_vectors
+from app.utils.vector_index import disaster_index
+from app.utils.dedup_progress import NullProgress
+from app.utils.report_search import sync_reports
+from app.utils.semantic_search import index_infos, unindex_infos
+
+# SQLite 单条语句的绑定参数有上限，IN 查询按块拆分
+_IN_CHUNK = 500
+# 合并 level 时 LLM 的最大并发请求数
+LEVEL_MERGE_CONCURRENCY = int(os.getenv("MERGE_LLM_CONCURRENCY", "8"))
 
 class _DSU:
     """简单并查集，用来把相似对聚成簇"""
@@ -23,27 +38,85 @@ class _DSU:
             self.parent[rb] = ra
 
 
+def _chunks(seq: list, size: int = _IN_CHUNK):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _load_cluster_rows(db: Session, ids: List[int]) -> dict:
+    """一次（按块）取出所有簇内记录需要的列，返回 {id: row}"""
+    cols = (
+        DisasterInfo.id, DisasterInfo.report_id,
+        DisasterInfo.time, DisasterInfo.location, DisasterInfo.event, DisasterInfo.level,
+        DisasterInfo.report_count,
+    )
+    rows = {}
+    for chunk in _chunks(ids):
+        for row in db.query(*cols).filter(DisasterInfo.id.in_(chunk)):
+            rows[row.id] = row
+    return rows
+
+
+def _display_ids(db: Session, rows: dict) -> dict:
+    """
+    构造 display_id 映射：{disaster_info.id: "3.1"}，即记录在所属报告内按 id 排序的序号。
+    只对涉及的报告用窗口函数计算，而不是加载全表。
+    """
+    report_ids = sorted({r.report_id for r in rows.values() if r.report_id is not None})
+    has_null = any(r.report_id is None for r in rows.values())
+    rn = func.row_number().over(
+        partition_by=DisasterInfo.report_id, order_by=DisasterInfo.id
+    ).label("rn")
+
+    id_to_display = {}
+    for chunk in _chunks(report_ids) if report_ids else [[]]:
+        cond = DisasterInfo.report_id.in_(chunk)
+        if has_null:
+            cond = or_(cond, DisasterInfo.report_id.is_(None))
+        sub = db.query(DisasterInfo.id, DisasterInfo.report_id, rn).filter(cond).subquery()
+        for row in db.query(sub.c.id, sub.c.report_id, sub.c.rn):
+            if row.id in rows:
+                id_to_display[row.id] = f"{row.report_id}.{row.rn}"
+        has_null = False  # NULL 分组只需统计一次
+    return id_to_display
+
+
+def _level_key(recs) -> tuple:
+    """level 的有序多重集合，作为 LLM 合并结果的记忆化键；所有 level 相同时无需合并，返回空元组"""
+    levels = [r.level or "" for r in recs]
+    if len(set(levels)) == 1:
+        return ()
+    return tuple(sorted(levels))
+
+
+def _resolve_level_merges(keys: set, max_workers: int = LEVEL_MERGE_CONCURRENCY) -> dict:
+    """并发合并所有不同的 level 组合，每种组合只调用一次 LLM"""
+    keys = sorted(keys)
+    if not keys:
+        return {}
+    print(f"[合并] 合并 {len(keys)} 组不同的 level 文本（并发 {max_workers}）")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        return dict(zip(keys, pool.map(lambda k: merge_level_texts(list(k)), keys)))
+
+
 def merge_duplicate_clusters(
     db: Session,
     similar_pairs: List[Tuple[int, int]],
+    progress=None,
 ) -> Tuple[int, int]:
     """
     接收 find_similar_disaster_infos 返回的相似对，
     聚簇后合并 & 删除，最后返回 (合并了多少簇, 删除了多少条记录)。
+    progress 只用于汇报进度：此时新记录已标记为已比对，合并阶段不响应取消。
+
+    集合式批量执行：一次取出所有簇内记录，先在内存中算好每个簇的合并结果
+    （需要 LLM 合并的 level 按组合去重后并发请求），再在同一事务里用 executemany 更新主记录、单条 DELETE ... WHERE id IN 删除其余记录，
+    最后只在涉及的报告里清理已没有元组的孤儿报告。
     """
+    progress = progress or NullProgress()
     if not similar_pairs:
         return 0, 0, []
 
-    # 构造 display_id 映射：{disaster_info.id: "3.1"}
-    all_disasters = db.query(DisasterInfo).order_by(DisasterInfo.report_id, DisasterInfo.id).all()
-    id_to_display = {}
-    report_groups = defaultdict(list)
-    for d in all_disasters:
-        report_groups[d.report_id].append(d)
-    for report_id, items in report_groups.items():
-        for idx, d in enumerate(items, 1):
-            id_to_display[d.id] = f"{report_id}.{idx}"
-
     # 1. 聚簇
     dsu = _DSU()
     for a, b in similar_pairs:
@@ -53,30 +126,89 @@ def merge_duplicate_clusters(
     for rid in {i for pair in similar_pairs for i in pair}:
         clusters[dsu.find(rid)].append(rid)
 
+    rows = _load_cluster_rows(db, [i for id_list in clusters.values() for i in id_list])
+    id_to_display = _display_ids(db, rows)
+
+    # 按 id 排序，与逐条查询时的返回顺序一致，保证 cluster_details 不变
+    cluster_recs = [
+        sorted((rows[i] for i in id_list if i in rows), key=lambda r: r.id)
+        for id_list in clusters.values()
+    ]
+    cluster_recs = [recs for recs in cluster_recs if len(recs) > 1]
+
+    # 2. 先并发解决所有簇的 level 合并，相同组合只请求一次
+    progress.update(stage="merging", processed=0, total=len(cluster_recs))
+    level_keys = [_level_key(recs) for recs in cluster_recs]
+    level_merges = _resolve_level_merges({k for k in level_keys if k})
+
     merged_clusters = 0
     deleted_records = 0
     cluster_details: List[dict] = []
+    updates: List[dict] = []
+    removed_ids: List[int] = []
+    touched_reports = set()
+    merged_into: dict[int, int] = {}  # 报告 id -> 接手其被合并四元组的报告 id
 
-    # 2. 对每个簇执行合并
-    for id_list in clusters.values():
-        recs = db.query(DisasterInfo).filter(DisasterInfo.id.in_(id_list)).all()
-        if len(recs) <= 1:
-            continue
-
+    # 3. 计算每个簇的合并结果
+    for done, (recs, level_key) in enumerate(zip(cluster_recs, level_keys), 1):
+        progress.update(processed=done)
         merged_clusters += 1
         deleted_records += len(recs) - 1
 
-        main = max(recs, key=lambda r: (r.report_count, -r.id))
-        to_delete = [r.id for r in recs if r.id != main.id]
+        values = _merge_one_cluster(recs, level_merges.get(level_key))
+        to_delete = [r.id for r in recs if r.id != values["id"]]
 
         cluster_details.append({
-            "main_display_id": id_to_display[main.id],
+            "main_display_id": id_to_display[values["id"]],
             "merged_display_ids": [id_to_display[i] for i in to_delete]
         })
+        updates.append(values)
+        removed_ids.extend(to_delete)
+        touched_reports.update(r.report_id for r in recs if r.report_id is not None)
+        for r in recs:
+            if r.id != values["id"] and r.report_id is not None and r.report_id != values["report_id"]:
+                merged_into.setdefault(r.report_id, values["report_id"])
+
+    if not updates:
+        return 0, 0, []
 
-        _merge_one_cluster(db, id_list)
+    # 4. 批量写入（同一事务）：更新主记录、删除其余记录及其向量
+    db.execute(update(DisasterInfo), updates)
+    for chunk in _chunks(removed_ids):
+        db.execute(delete(DisasterInfo).where(DisasterInfo.id.in_(chunk)))
+    drop_vectors(db, removed_ids)
 
-    db.commit()
+    # 主记录字段若有变化，内容哈希随之改变，这里会重新编码并写回向量
+    mains = [SimpleNamespace(**v) for v in updates]
+    main_vectors = get_vectors(db, mains)
+
+    # 5. 只检查涉及的报告是否成了孤儿；引用孤儿报告的原文重复改为指向接手其四元组的报告
+    orphan_count = 0
+    for chunk in _chunks(sorted(touched_reports)):
+        orphan_ids = [
+            row.id for row in
+            db.query(Report.id).filter(Report.id.in_(chunk), ~Report.disaster_infos.any())
+        ]
+        if not orphan_ids:
+            continue
+        for orphan_id in orphan_ids:
+            db.query(Report).filter(Report.duplicate_of == orphan_id).update(
+                {Report.duplicate_of: merged_into.get(orphan_id)}, synchronize_session=False
+            )
+        db.query(Report).filter(Report.id.in_(orphan_ids)).delete(synchronize_session=False)
+        orphan_count += len(orphan_ids)
+    # 主记录内容变化、其余记录被删除、孤儿报告被删除，涉及的报告都要重写全文索引
+    sync_reports(db, touched_reports)
+
+    db.commit()  # 提交时会话内对象全部过期，批量语句绕过的对象状态也随之刷新
+    if orphan_count:
+        print(f"[合并] 删除 {orphan_count} 条已无灾情元组的报告")
+
+    # 提交成功后同步历史向量索引：删掉被合并的记录，主记录按合并后的内容覆盖
+    disaster_index.remove(removed_ids)
+    disaster_index.add([m.id for m in mains], main_vectors)
+    unindex_infos(removed_ids)
+    index_infos(mains)
     return merged_clusters, deleted_records, cluster_details
 
 def _choose_longest(values: List[str]) -> str:
@@ -84,54 +216,47 @@ def _choose_longest(values: List[str]) -> str:
     return max(values, key=lambda s: (len(s), s or ""))
 
 
-def _merge_one_cluster(db: Session, id_list: List[int]):
-    recs = (
-        db.query(DisasterInfo)
-        .filter(DisasterInfo.id.in_(id_list))
-        .all()
-    )
-    if len(recs) <= 1:
-        return
-
-    # 1. report_count 累加所有历史值 —— 
+def _merge_one_cluster(recs, merged_level: str = None) -> dict:
+    """
+    计算一个簇合并后主记录的各字段，返回可直接用于按主键批量 UPDATE 的字典。
+    merged_level 为预先并发算好的 level 合并结果；未提供且 level 不同时才在此调用 LLM。
+    """
+    # 1. report_count 累加所有历史值 ——
     total_count = sum(r.report_count for r in recs)
 
-    # 2. time / location 取最长 —— 
+    # 2. time / location 取最长 ——
     merged_time = _choose_longest([r.time or "" for r in recs])
     merged_loc  = _choose_longest([r.location or "" for r in recs])
 
-    # 3. event 取众数，如并列再取最长 —— 
+    # 3. event 取众数，如并列再取最长 ——
     cnt = Counter(r.event or "" for r in recs)
     top_freq = cnt.most_common(1)[0][1]
     merged_event = _choose_longest([e for e, f in cnt.items() if f == top_freq])
 
-    # 4. level 是否相同，不同则调用 LLM 合并 —— 
+    # 4. level 是否相同，不同则调用 LLM 合并 ——
     levels = [r.level or "" for r in recs]
     if len(set(levels)) == 1:
         merged_level = levels[0]
-    else:
+    elif merged_level is None:
         merged_level = merge_level_texts(levels)
 
-    # 5. 选主记录：当前 report_count 最大，其次 id 最小 —— 
+    # 5. 选主记录：当前 report_count 最大，其次 id 最小 ——
     main = max(recs, key=lambda r: (r.report_count, -r.id))
 
-    # 更新主记录
-    main.time         = merged_time
-    main.location     = merged_loc
-    main.event        = merged_event
-    main.level        = merged_level
-    main.report_count = total_count
-
     # 补充 report_id，如果丢了
-    if not main.report_id:
+    report_id = main.report_id
+    if not report_id:
         for r in recs:
             if r.report_id:
-                main.report_id = r.report_id
+                report_id = r.report_id
                 break
 
-    db.add(main)  #明确告诉 SQLAlchemy：main 有变动
-    db.flush() 
-    # 删除其他重复记录
-    for r in recs:
-        if r.id != main.id:
-            db.delete(r)
\ No newline at end of file
+    return {
+        "id": main.id,
+        "report_id": report_id,
+        "time": merged_time,
+        "location": merged_loc,
+        "event": merged_event,
+        "level": merged_level,
+        "report_count": total_count,
+    }
@@ -0,0 +1,176 @@
+# app/utils/near_dup.py
+
+import datetime
+import hashlib
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.models.report import Report
+from app.models.disaster_info import DisasterInfo
+
+# 上报前的原文近似重复检查：命中时复用已有报告的摘要与四元组，不再调用 LLM
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") == "1"
+# SimHash 汉明距离不超过该值视为近似重复。空白 / 标点 / 时间点之类的小改动一般在 8 以内，
+# 不同事件的文本一般在 20 以上；64 位分 8 段，<= 7 时保证至少一段完全相同而被 LSH 召回
+NEAR_DUP_MAX_HAMMING = int(os.getenv("NEAR_DUP_MAX_HAMMING", "7"))
+# 只与最近这么多天内的报告比对
+NEAR_DUP_WINDOW_DAYS = int(os.getenv("NEAR_DUP_WINDOW_DAYS", "7"))
+# 规范化后短于该长度的文本 SimHash 不稳定，只做精确匹配
+NEAR_DUP_MIN_CHARS = int(os.getenv("NEAR_DUP_MIN_CHARS", "20"))
+
+_SHINGLES = (2, 3)
+_BANDS = 8
+_BAND_BITS = 64 // _BANDS
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """全半角统一、小写，去掉空白和标点"""
+    return _NON_WORD_RE.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def simhash(norm: str) -> int:
+    """按字符 2-gram + 3-gram 计算 64 位 SimHash（无符号）"""
+    weights = [0] * 64
+    shingles = Counter(
+        norm[i:i + k] for k in _SHINGLES for i in range(max(1, len(norm) - k + 1))
+    )
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _bands(value: int) -> list[int]:
+    mask = (1 << _BAND_BITS) - 1
+    return [value >> (i * _BAND_BITS) & mask for i in range(_BANDS)]
+
+
+def fingerprint(text: str) -> tuple[str, Optional[int]]:
+    """返回 (规范化文本哈希, 无符号 SimHash)；文本过短时 SimHash 为 None"""
+    norm = normalize_text(text)
+    text_hash = hashlib.sha1(norm.encode("utf-8")).hexdigest()
+    return text_hash, simhash(norm) if len(norm) >= NEAR_DUP_MIN_CHARS else None
+
+
+def set_fingerprint(report: Report):
+    """为报告写入原文指纹（入库 / 修改原文时调用）"""
+    report.text_hash, value = fingerprint(report.text)
+    bands = _bands(value) if value is not None else [None] * _BANDS
+    report.simhash = _to_signed(value) if value is not None else None
+    for i, band in enumerate(bands):
+        setattr(report, f"sim_band{i}", band)
+
+
+def _resolve(db: Session, report: Report) -> Optional[Report]:
+    """沿 duplicate_of 找到真正做过抽取的报告"""
+    seen = set()
+    while report is not None and report.duplicate_of is not None and report.id not in seen:
+        seen.add(report.id)
+        report = db.get(Report, report.duplicate_of)
+    return report if report is not None and report.status == "done" else None
+
+
+def find_duplicate(db: Session, text: str, exclude_id: int = None) -> Optional[Report]:
+    """
+    在最近 NEAR_DUP_WINDOW_DAYS 天已完成抽取的报告中查找原文的精确 / 近似重复：
+    先按规范化文本哈希精确匹配，再用 SimHash 分段做 LSH 召回、按汉明距离确认，取距离最小（并列取最新）的一条。
+    """
+    text_hash, value = fingerprint(text)
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=NEAR_DUP_WINDOW_DAYS)
+    base = db.query(Report).filter(Report.status == "done", Report.created_at >= since)
+    if exclude_id is not None:
+        base = base.filter(Report.id != exclude_id)
+
+    exact = base.filter(Report.text_hash == text_hash).order_by(Report.id.desc()).first()
+    if exact is not None:
+        return _resolve(db, exact)
+    if value is None:
+        return None
+
+    # 任一分段相同即为候选，只取比对需要的两列
+    band_match = or_(*(
+        getattr(Report, f"sim_band{i}") == band for i, band in enumerate(_bands(value))
+    ))
+    best_id, best_dist = None, NEAR_DUP_MAX_HAMMING + 1
+    for cand_id, cand_hash in base.with_entities(Report.id, Report.simhash).filter(band_match):
+        if cand_hash is None:
+            continue
+        dist = bin((cand_hash & ((1 << 64) - 1)) ^ value).count("1")
+        if dist < best_dist or (dist == best_dist and best_id is not None and cand_id > best_id):
+            best_id, best_dist = cand_id, dist
+    return _resolve(db, db.get(Report, best_id)) if best_id is not None else None
+
+
+def link_duplicate(db: Session, report: Report, original_id: int, summary: str):
+    """
+    把报告标记为已有报告的重复：复用摘要、记录 duplicate_of，
+    并把被复用报告各四元组的上报次数加一（由调用方提交事务）。
+    """
+    report.summary = summary
+    report.duplicate_of = original_id
+    report.status, report.error = "done", None
+    db.query(DisasterInfo).filter(DisasterInfo.report_id == original_id).update(
+        {DisasterInfo.report_count: DisasterInfo.report_count + 1}, synchronize_session=False
+    )
+    print(f"[近似重复] 原文与报告 {original_id} 重复，复用其抽取结果")
+
+
+def unlink_duplicate(db: Session, report: Report):
+    """
+    报告不再作为重复（被删除或原文被修改）：撤回 link_duplicate 给被复用报告各四元组加的上报次数
+    （由调用方提交事务）。
+    """
+    if report.duplicate_of is None:
+        return
+    db.query(DisasterInfo).filter(
+        DisasterInfo.report_id == report.duplicate_of, DisasterInfo.report_count > 1
+    ).update({DisasterInfo.report_count: DisasterInfo.report_count - 1}, synchronize_session=False)
+    report.duplicate_of = None
+
+
+def hand_over_duplicates(db: Session, report: Report) -> Optional[Report]:
+    """
+    报告即将被删除或原文被替换时，引用它的重复报告不能再指向它：
+    把它现有的四元组移交给最早的一条重复报告（原文相同，抽取结果同样适用）并扣掉它自己那一次上报，
+    其余重复改为指向这条报告。返回接手的报告，没有重复时返回 None（由调用方提交事务）。
+    """
+    duplicates = db.query(Report).filter(Report.duplicate_of == report.id).order_by(Report.id).all()
+    if not duplicates:
+        return None
+    heir = duplicates[0]
+    for info in list(report.disaster_infos):
+        info.report = heir
+        info.report_count = max(1, (info.report_count or 1) - 1)
+    heir.duplicate_of = None
+    heir.summary = report.summary
+    for dup in duplicates[1:]:
+        dup.duplicate_of = heir.id
+    print(f"[近似重复] 报告 {report.id} 的 {len(duplicates)} 条重复改由报告 {heir.id} 承接")
+    return heir
+
+
+def shared_infos(db: Session, reports) -> dict[int, list[DisasterInfo]]:
+    """原文重复的报告本身没有四元组：批量取出被复用报告的四元组，返回 {重复报告 id: 四元组列表}"""
+    dups = {r.id: r.duplicate_of for r in reports if r.duplicate_of is not None and not r.disaster_infos}
+    if not dups:
+        return {}
+    by_original: dict[int, list[DisasterInfo]] = {}
+    for info in (
+        db.query(DisasterInfo)
+        .filter(DisasterInfo.report_id.in_(set(dups.values())))
+        .order_by(DisasterInfo.id)
+    ):
+        by_original.setdefault(info.report_id, []).append(info)
+    return {rid: by_original.get(original_id, []) for rid, original_id in dups.items()}
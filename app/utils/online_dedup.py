@@ -0,0 +1,94 @@
+# app/utils/online_dedup.py
+
+import os
+from typing import List
+
+from sqlalchemy import func
+
+from app.db.session import SessionLocal
+from app.models.disaster_info import DisasterInfo
+from app.utils.blocking import block_key, blocks_compatible
+from app.utils.dedup_jobs import batch_job_active, run_lock
+from app.utils.embedding_store import get_vectors
+from app.utils.merge_engine import merge_duplicate_clusters
+from app.utils.vector_index import disaster_index
+
+# 开启后，新上报的灾情元组在入库后立即在后台与历史索引比对
+STREAMING_ENABLED = os.getenv("DEDUP_STREAMING", "0") == "1"
+# 在线阶段只处理高置信度的重复，模糊区间留给批量去重交给 LLM 复核
+ONLINE_THRESHOLD = float(os.getenv("DEDUP_ONLINE_THRESHOLD", "0.9"))
+ONLINE_FUZZY_LOWER = float(os.getenv("DEDUP_ONLINE_FUZZY_LOWER", "0.6"))
+ONLINE_TOP_K = 5
+
+
+def check_new_infos(info_ids: List[int]):
+    """
+    入库后的在线去重（由 BackgroundTasks 调用）。逐条检索历史索引：
+    - 存在高置信度（>= ONLINE_THRESHOLD 且分块兼容）的历史记录：立即合并，并标记为已比对；
+    - 没有任何达到 ONLINE_FUZZY_LOWER 的候选：直接标记为已比对并加入历史索引；
+    - 只有模糊候选：保持未比对，留给批量去重用 LLM 复核。
+    批量去重正在运行时直接跳过，这些记录会被那一轮或下一轮批量去重处理：
+    run_lock 只挡住本进程内的批量任务，其他 worker 进程发起的任务通过数据库中的任务记录判断。
+    历史索引缺失或与已比对记录数对不上（升级后尚未重建、其他进程中途退出等）时同样跳过：
+    此时与索引比对等于没比，若标记为已比对，批量去重就再也不会处理这些记录。
+    """
+    if not info_ids or not run_lock.acquire(blocking=False):
+        return
+    db = SessionLocal()
+    try:
+        if batch_job_active(db):
+            return
+        checked = db.query(func.count(DisasterInfo.id)).filter(DisasterInfo.has_been_checked == True).scalar()
+        if disaster_index.ntotal != checked:
+            print(f"[在线去重] 历史索引 {disaster_index.ntotal} 条，已比对记录 {checked} 条，跳过，留给批量去重")
+            return
+        records = (
+            db.query(DisasterInfo)
+            .filter(DisasterInfo.id.in_(info_ids), DisasterInfo.has_been_checked == False)
+            .order_by(DisasterInfo.id)
+            .all()
+        )
+        if not records:
+            return
+        vectors = get_vectors(db, records)
+        db.commit()  # 先落盘向量，后续合并在独立事务里进行
+
+        pairs = []
+        for record, vec in zip(records, vectors):
+            scores, neighbor_ids = disaster_index.search(vec.reshape(1, -1), ONLINE_TOP_K)
+            hit_ids = [int(t) for t in neighbor_ids[0] if t >= 0]
+            olds = {
+                r.id: r for r in
+                db.query(DisasterInfo).filter(DisasterInfo.id.in_(hit_ids))
+            } if hit_ids else {}
+
+            key = block_key(record)
+            match, has_fuzzy = None, False
+            for score, target_id in zip(scores[0], neighbor_ids[0]):
+                old = olds.get(int(target_id))
+                if old is None or not blocks_compatible(key, block_key(old)):
+                    continue
+                if score >= ONLINE_THRESHOLD:
+                    match = old
+                    break
+                if score >= ONLINE_FUZZY_LOWER:
+                    has_fuzzy = True
+
+            if match is None and has_fuzzy:
+                continue  # 留给批量去重
+            record.has_been_checked = True
+            db.commit()
+            # 立即入索引，同一批里后面的记录也能与它比对
+            disaster_index.add([record.id], vec.reshape(1, -1))
+            if match is not None:
+                pairs.append(tuple(sorted([record.id, match.id])))
+
+        if pairs:
+            merged, deleted, details = merge_duplicate_clusters(db, pairs)
+            print(f"[在线去重] 合并 {merged} 簇，删除 {deleted} 条：{details}")
+    except Exception as e:
+        db.rollback()
+        print(f"[在线去重异常] {e}")
+    finally:
+        db.close()
+        run_lock.release()
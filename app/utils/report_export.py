@@ -0,0 +1,106 @@
+# app/utils/report_export.py
+
+import csv
+import io
+import os
+import tempfile
+import zlib
+from typing import Iterable, Iterator
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+
+from app.models.report import Report
+from app.models.disaster_info import DisasterInfo
+
+# 每次从数据库取回的行数，以及 CSV 累积多少字节后输出一次
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "1000"))
+_FLUSH_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "report_export.xlsx"),
+    "csv": ("text/csv; charset=utf-8", "report_export.csv"),
+    "csv.gz": ("application/gzip", "report_export.csv.gz"),
+}
+
+HEADER = ["报告ID", "摘要", "上报时间", "时间", "地点", "灾害类型", "受灾程度", "上报次数"]
+
+
+def iter_export_rows(db: Session, report_ids: Query = None) -> Iterator[list]:
+    """
+    按 (报告 id 倒序, 四元组 id) 逐行产出导出数据，每个四元组一行。
+    只取需要的列、yield_per 分块读取，内存占用与结果总量无关；report_ids 为筛选报告 id 的查询，None 表示全部。
+    原文重复的报告本身没有四元组，导出被复用报告的四元组（与接口返回一致）。
+    """
+    query = db.query(
+        Report.id, Report.summary, Report.created_at,
+        DisasterInfo.time, DisasterInfo.location, DisasterInfo.event, DisasterInfo.level,
+        DisasterInfo.report_count,
+    ).join(DisasterInfo, DisasterInfo.report_id == func.coalesce(Report.duplicate_of, Report.id))
+    if report_ids is not None:
+        query = query.filter(Report.id.in_(report_ids.order_by(None).scalar_subquery()))
+    for row in query.order_by(Report.id.desc(), DisasterInfo.id).yield_per(EXPORT_CHUNK):
+        yield [
+            row[0],
+            row.summary,
+            row.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            row.time,
+            row.location,
+            row.event,
+            row.level,
+            row.report_count,
+        ]
+
+
+def stream_csv(rows: Iterable[list], gzip: bool = False) -> Iterator[bytes]:
+    """边写边输出 CSV（带 BOM，Excel 可直接打开）；gzip=True 时同时做流式 gzip 压缩"""
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(HEADER)
+
+    def drain(final: bool = False) -> bytes:
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        if compressor is not None:
+            data = compressor.compress(data) + (compressor.flush() if final else b"")
+        return data
+
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= _FLUSH_BYTES:
+            chunk = drain()
+            if chunk:
+                yield chunk
+    chunk = drain(final=True)
+    if chunk:
+        yield chunk
+
+
+def stream_xlsx(rows: Iterable[list]) -> Iterator[bytes]:
+    """
+    openpyxl 只写模式逐行写入（行数据随写随落盘，不在内存中保留整个工作表），
+    保存到临时文件后分块读出；xlsx 是 zip 包，只能在全部行写完后才开始输出。
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("灾情报告")
+    ws.append(HEADER)
+    for row in rows:
+        ws.append(row)
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(_FLUSH_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
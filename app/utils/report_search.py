@@ -0,0 +1,157 @@
+# app/utils/report_search.py
+
+"""
+报告全文检索索引：每条报告一行，内容为摘要 + 全部四元组字段。
+- SQLite：FTS5 虚表（trigram 分词，3 字及以上的词走索引，1~2 字的词在索引表上做 LIKE）；
+- MySQL：InnoDB 表 + ngram FULLTEXT 索引；
+- 其他数据库或建索引失败时返回 None，由调用方退回原来的 LIKE 查询。
+索引内容由调用方在报告 / 四元组变化的同一事务里调用 sync_reports 维护。
+"""
+
+import os
+from typing import Iterable, Optional
+
+from sqlalchemy import Float, Integer, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.models.report import Report
+from app.models.disaster_info import DisasterInfo
+
+FTS_ENABLED = os.getenv("REPORT_FTS", "1") == "1"
+FTS_TABLE = "report_fts"
+# 回填 / 同步时按块处理的报告数
+_CHUNK = 500
+
+# 各数据库能走索引的最短词长：trigram 为 3，MySQL ngram_token_size 默认为 2
+_MIN_TERM = {"sqlite": 3, "mysql": 2}
+
+_backend_cache: dict = {}
+
+
+def _chunks(seq: list, size: int = _CHUNK):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _backend(bind) -> Optional[str]:
+    """当前数据库可用的全文索引类型（sqlite / mysql），不可用时为 None"""
+    key = id(bind)
+    if key not in _backend_cache:
+        dialect = bind.dialect.name
+        ok = FTS_ENABLED and dialect in _MIN_TERM and inspect(bind).has_table(FTS_TABLE)
+        _backend_cache[key] = dialect if ok else None
+    return _backend_cache[key]
+
+
+def ensure_search_index(engine):
+    """建索引表（不存在时）并回填已有报告；启动时由 init_db 调用"""
+    if not FTS_ENABLED or engine.dialect.name not in _MIN_TERM:
+        return
+    if inspect(engine).has_table(FTS_TABLE):
+        return
+    if engine.dialect.name == "sqlite":
+        ddl = f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(summary, infos, tokenize='trigram')"
+    else:
+        ddl = (
+            f"CREATE TABLE {FTS_TABLE} ("
+            " report_id INT PRIMARY KEY, summary TEXT, infos TEXT,"
+            " FULLTEXT KEY ft_report (summary, infos) WITH PARSER ngram"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(ddl))
+    except SQLAlchemyError as e:
+        # 例如 SQLite 版本低于 3.34 不支持 trigram：保持 LIKE 查询
+        print(f"[全文检索] 创建索引表失败，使用 LIKE 查询：{e}")
+        return
+    _backend_cache.pop(id(engine), None)
+
+    from app.db.session import SessionLocal
+    db = SessionLocal()
+    try:
+        ids = [row.id for row in db.query(Report.id).order_by(Report.id)]
+        for chunk in _chunks(ids):
+            sync_reports(db, chunk)
+            db.commit()
+        print(f"[全文检索] 已建立索引表 {FTS_TABLE}，回填 {len(ids)} 条报告")
+    finally:
+        db.close()
+
+
+def _key_column(backend: str) -> str:
+    return "rowid" if backend == "sqlite" else "report_id"
+
+
+def sync_reports(db: Session, report_ids: Iterable[int]):
+    """
+    按当前数据库内容重写这些报告的索引行；已删除的报告只删除索引行。由调用方提交事务。
+    """
+    backend = _backend(db.get_bind())
+    ids = sorted({i for i in report_ids if i is not None})
+    if backend is None or not ids:
+        return
+    key = _key_column(backend)
+    for chunk in _chunks(ids):
+        params = {f"id{i}": rid for i, rid in enumerate(chunk)}
+        in_list = ", ".join(f":id{i}" for i in range(len(chunk)))
+        db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE {key} IN ({in_list})"), params)
+
+        infos: dict[int, list[str]] = {}
+        rows = db.query(
+            DisasterInfo.report_id, DisasterInfo.time, DisasterInfo.location,
+            DisasterInfo.event, DisasterInfo.level,
+        ).filter(DisasterInfo.report_id.in_(chunk)).order_by(DisasterInfo.id)
+        for row in rows:
+            infos.setdefault(row.report_id, []).append(
+                " ".join(v for v in (row.time, row.location, row.event, row.level) if v)
+            )
+        docs = [
+            {"id": rid, "summary": summary or "", "infos": "\n".join(infos.get(rid, []))}
+            for rid, summary in db.query(Report.id, Report.summary).filter(Report.id.in_(chunk))
+        ]
+        if docs:
+            db.execute(
+                text(f"INSERT INTO {FTS_TABLE} ({key}, summary, infos) VALUES (:id, :summary, :infos)"),
+                docs,
+            )
+
+
+def search_hits(db: Session, q: str):
+    """
+    返回命中报告的子查询 (report_id, score)，score 越小越相关；索引不可用时返回 None。
+    多个以空白分隔的词之间为“且”的关系；短于索引最短词长的词在索引表上用 LIKE 匹配。
+    """
+    backend = _backend(db.get_bind())
+    terms = q.split()
+    if backend is None or not terms:
+        return None
+
+    min_len = _MIN_TERM[backend]
+    long_terms = [t for t in terms if len(t) >= min_len]
+    short_terms = [t for t in terms if len(t) < min_len]
+    params, conds = {}, []
+    if backend == "sqlite":
+        key, score = "rowid", "0.0"
+        if long_terms:
+            # 整词加引号作为短语匹配，引号本身按 FTS5 规则双写转义
+            params["match"] = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            conds.append(f"{FTS_TABLE} MATCH :match")
+            score = f"bm25({FTS_TABLE})"
+    else:
+        key, score = "report_id", "0.0"
+        if long_terms:
+            params["match"] = " ".join('+"' + t.replace('"', " ") + '"' for t in long_terms)
+            against = "MATCH(summary, infos) AGAINST (:match IN BOOLEAN MODE)"
+            conds.append(against)
+            score = f"-{against}"
+    for i, t in enumerate(short_terms):
+        escaped = t.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        params[f"like{i}"] = f"%{escaped}%"
+        conds.append(f"(summary LIKE :like{i} ESCAPE '!' OR infos LIKE :like{i} ESCAPE '!')")
+
+    stmt = text(
+        f"SELECT {key} AS report_id, {score} AS score FROM {FTS_TABLE} WHERE " + " AND ".join(conds)
+    ).bindparams(**params).columns(report_id=Integer, score=Float)
+    return stmt.subquery("hits")
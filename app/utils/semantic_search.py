@@ -0,0 +1,178 @@
+# app/utils/semantic_search.py
+
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.models.disaster_info import DisasterInfo
+from app.utils.blocking import TimeBucket, event_category, time_bucket
+from app.utils.embedder import encode_texts
+from app.utils.vector_index import DisasterIndex
+
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "./data/disaster_search.index")
+# 检索时至多每隔这么久在后台核对一次索引与数据库是否一致，不一致时按 id 增量修复
+SEMANTIC_REPAIR_SECS = float(os.getenv("SEMANTIC_REPAIR_SECS", "60"))
+
+# 有筛选条件时的初始过采样倍数；筛选后结果不足时检索范围翻倍，直到 SEMANTIC_MAX_CANDIDATES
+SEMANTIC_OVERSAMPLE = int(os.getenv("SEMANTIC_OVERSAMPLE", "4"))
+SEMANTIC_MAX_CANDIDATES = int(os.getenv("SEMANTIC_MAX_CANDIDATES", "4096"))
+# 每条报告平均的四元组数，用于估算需要检索多少条四元组才能凑够 k 条报告
+_INFOS_PER_REPORT = 2
+_IN_CHUNK = 500
+
+
+def info_text(item) -> str:
+    """四元组的检索文本：时间、地点、事件、程度按顺序拼接，空字段跳过"""
+    return " ".join(v for v in (item.time, item.location, item.event, item.level) if v)
+
+
+class SemanticIndex(DisasterIndex):
+    """
+    语义检索用的向量索引：收录全部四元组（不论是否已比对），每条一个向量，
+    由四元组拼接文本整体编码，与查询句的编码方式一致；去重用的历史索引与融合向量不受影响。
+    """
+
+    label = "检索索引"
+
+    def _scope(self, query):
+        return query
+
+    def _vectors(self, db: Session, rows) -> np.ndarray:
+        return encode_texts([info_text(r) for r in rows])
+
+
+semantic_index = SemanticIndex(SEMANTIC_INDEX_PATH)
+
+_repair_lock = threading.Lock()
+_last_repair_check = float("-inf")
+
+
+def _repair_in_background():
+    """
+    检索路径上的索引维护：不在请求里重建，只按间隔起一个后台线程对账，同一时刻至多一个。
+    提交与写索引之间的短暂不一致、写索引失败、其他 worker 进程的写入，都由这里补齐。
+    """
+    global _last_repair_check
+    now = time.monotonic()
+    if now - _last_repair_check < SEMANTIC_REPAIR_SECS or not _repair_lock.acquire(blocking=False):
+        return
+    _last_repair_check = now
+
+    def run():
+        db = SessionLocal()
+        try:
+            expected = db.query(func.count(DisasterInfo.id)).scalar()
+            if semantic_index.ntotal != expected:
+                semantic_index.repair(db)
+        except Exception as e:
+            db.rollback()
+            print(f"[检索索引] 对账修复失败：{e}")
+        finally:
+            db.close()
+            _repair_lock.release()
+
+    threading.Thread(target=run, daemon=True, name="semantic-repair").start()
+
+
+def index_infos(infos):
+    """
+    新增或修改的四元组写入检索索引，由调用方在事务提交后调用。
+    编码失败只打印日志：报告已落库，缺失的记录会在检索触发的后台对账中补上。
+    """
+    infos = [d for d in infos if d.id is not None]
+    if not infos:
+        return
+    try:
+        semantic_index.add([d.id for d in infos], encode_texts([info_text(d) for d in infos]))
+    except Exception as e:
+        print(f"[检索索引] 写入 {len(infos)} 条四元组失败：{e}")
+
+
+def unindex_infos(info_ids: Iterable[int]):
+    """已删除的四元组移出检索索引，由调用方在事务提交后调用"""
+    try:
+        semantic_index.remove(info_ids)
+    except Exception as e:
+        print(f"[检索索引] 移除四元组失败：{e}")
+
+
+def parse_date_bound(value: str, upper: bool) -> Optional[tuple]:
+    """把 “2024-09” / “2024年9月” / “2024” 之类的边界解析为 (年, 月)；只给年份时取该年的首月 / 末月"""
+    bucket = time_bucket(value)
+    if bucket is None:
+        return None
+    year, month = bucket
+    return year, month if month is not None else (12 if upper else 1)
+
+
+def _in_range(bucket: TimeBucket, date_from: tuple = None, date_to: tuple = None) -> bool:
+    """时间未知的记录在有日期筛选时排除；只有年份的记录按年份判断"""
+    if date_from is None and date_to is None:
+        return True
+    if bucket is None:
+        return False
+    year, month = bucket
+    earliest = (year, month if month is not None else 1)
+    latest = (year, month if month is not None else 12)
+    return (date_from is None or latest >= date_from) and (date_to is None or earliest <= date_to)
+
+
+def semantic_report_hits(
+    db: Session,
+    q: str,
+    k: int,
+    event: str = None,
+    date_from: tuple = None,
+    date_to: tuple = None,
+) -> list[tuple[int, float]]:
+    """
+    用与去重相同的模型编码查询，在检索索引（全部四元组）中检索相近的四元组，
+    按事件类别 / 时间范围筛选后按报告聚合（取报告内最高相似度），返回最多 k 个 (report_id, similarity)，相似度降序。
+    筛选发生在截断之前：筛掉的候选不占名额，结果不足时扩大检索范围重试。
+    """
+    if not q.strip():
+        return []
+    _repair_in_background()
+    total = semantic_index.ntotal
+    if total == 0:
+        return []
+    query_vec = encode_texts([q])
+    category = event_category(event) if event else None
+    filtered = category is not None or date_from is not None or date_to is not None
+
+    search_k = min(total, k * _INFOS_PER_REPORT * (SEMANTIC_OVERSAMPLE if filtered else 1))
+    checked: dict[int, Optional[int]] = {}  # info_id -> 通过筛选的 report_id（未通过为 None）
+    while True:
+        scores, ids = semantic_index.search(query_vec, search_k)
+        hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+
+        unseen = [i for i, _ in hits if i not in checked]
+        for start in range(0, len(unseen), _IN_CHUNK):
+            rows = db.query(
+                DisasterInfo.id, DisasterInfo.report_id, DisasterInfo.time, DisasterInfo.event
+            ).filter(DisasterInfo.id.in_(unseen[start:start + _IN_CHUNK]))
+            for row in rows:
+                ok = (
+                    row.report_id is not None
+                    and (category is None or event_category(row.event) == category)
+                    and _in_range(time_bucket(row.time), date_from, date_to)
+                )
+                checked[row.id] = row.report_id if ok else None
+
+        best: dict[int, float] = {}
+        for info_id, score in hits:
+            report_id = checked.get(info_id)
+            if report_id is not None and score > best.get(report_id, float("-inf")):
+                best[report_id] = score
+        if len(best) >= k or search_k >= min(total, SEMANTIC_MAX_CANDIDATES):
+            break
+        search_k = min(total, SEMANTIC_MAX_CANDIDATES, search_k * 2)
+
+    ranked = sorted(best.items(), key=lambda item: (-item[1], -item[0]))
+    return ranked[:k]
@@ -0,0 +1,311 @@
+# app/utils/vector_index.py
+
+import math
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterable
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.disaster_info import DisasterInfo
+from app.utils.embedding_store import get_vectors
+
+INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./data/disaster_info.index")
+# 历史记录少于该数量时用精确的 Flat 索引，达到后（重建或增量写入时）转为 IVF 倒排索引
+IVF_MIN_RECORDS = int(os.getenv("FAISS_IVF_MIN_RECORDS", "20000"))
+IVF_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+IVF_MAX_NLIST = 1024
+REBUILD_CHUNK = 2000
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    vecs = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return np.ascontiguousarray(vecs / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def _as_ids(ids: Iterable[int]) -> np.ndarray:
+    return np.asarray(list(ids), dtype=np.int64)
+
+
+class DisasterIndex:
+    """
+    已比对（has_been_checked=True）灾情记录的常驻向量索引。
+
+    内积索引，向量先做 L2 归一化，外部 id 即 DisasterInfo.id：记录较少时为 IndexIDMap 包一层 Flat，
+    达到 IVF_MIN_RECORDS 后为 IndexIVFFlat（自身按 id 存储，不能再套 IndexIDMap：
+    IndexIDMap.remove_ids 依赖内部序号随删除前移，IVF 不满足，删除后 id 会错位）。
+    索引文件用 faiss.write_index 持久化，首次使用时才加载；若文件被其他进程更新过会自动重新加载。
+    多个 worker 进程共用同一个索引文件：增删时在 <path>.lock 上加 flock 排他锁，
+    “加载最新文件 → 修改 → 保存”整个过程串行，避免互相覆盖对方写入的记录。
+    faiss 同样在首次使用时才导入。
+    """
+
+    label = "向量索引"
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self._index = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    # ---------- 加载 / 保存 ----------
+    def _file_version(self):
+        """文件版本：每次保存都是原子替换出的新文件，inode 与纳秒级 mtime 任一变化即视为已更新"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程排他锁，须在 self._lock 内使用"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _get(self):
+        """惰性加载索引；文件不存在时返回 None"""
+        version = self._file_version()
+        if version is None:
+            # 文件已被其他进程删除（重建时没有历史记录）
+            self._index, self._version = None, None
+        elif version != self._version:
+            import faiss
+            index = faiss.downcast_index(faiss.read_index(self.path))
+            if isinstance(index, faiss.IndexIDMap) and self._ivf(index.index) is not None:
+                # 旧版本写出的 IndexIDMap(IVF)：删除过记录后 id 可能已错位，弃用，等待下次重建
+                print(f"[{self.label}] 索引文件为旧格式（IndexIDMap 包装 IVF），需要重建")
+                index = None
+            else:
+                self._tune(index)
+            self._index, self._version = index, version
+        return self._index
+
+    @staticmethod
+    def _ivf(index):
+        """索引为 IVF 时返回向下转型后的 IVF 索引，否则返回 None"""
+        import faiss
+        index = faiss.downcast_index(index)
+        return index if isinstance(index, faiss.IndexIVF) else None
+
+    def _tune(self, index):
+        ivf = self._ivf(index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+
+    def _save(self):
+        import faiss
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        faiss.write_index(self._index, tmp_path)
+        os.replace(tmp_path, self.path)  # 原子替换，避免其他进程读到半个文件
+        self._version = self._file_version()
+
+    @property
+    def ntotal(self) -> int:
+        with self._lock:
+            index = self._get()
+            return index.ntotal if index is not None else 0
+
+    # ---------- 查询 / 增量维护 ----------
+    def search(self, vectors: np.ndarray, top_k: int):
+        """返回 (scores, ids)，ids 为 DisasterInfo.id，空位为 -1"""
+        with self._lock:
+            index = self._get()
+            if index is None or index.ntotal == 0 or len(vectors) == 0:
+                n = len(vectors)
+                return np.zeros((n, top_k), dtype=np.float32), np.full((n, top_k), -1, dtype=np.int64)
+            return index.search(_normalized(vectors), top_k)
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        """写入或覆盖记录向量（同 id 先删后加）；Flat 索引增长到 IVF_MIN_RECORDS 时就地转为 IVF"""
+        import faiss
+        ids = _as_ids(ids)
+        if len(ids) == 0:
+            return
+        with self._lock, self._file_lock():
+            index = self._get()
+            if index is None:
+                index = faiss.IndexIDMap(faiss.IndexFlatIP(vectors.shape[1]))
+            else:
+                index.remove_ids(ids)
+            index.add_with_ids(_normalized(vectors), ids)
+            if index.ntotal >= IVF_MIN_RECORDS and self._ivf(index) is None:
+                index = self._upgrade_to_ivf(index)
+            self._index = index
+            self._save()
+
+    def remove(self, ids: Iterable[int]):
+        ids = _as_ids(ids)
+        if len(ids) == 0:
+            return
+        with self._lock, self._file_lock():
+            index = self._get()
+            if index is None:
+                return
+            index.remove_ids(ids)
+            self._save()
+
+    def _upgrade_to_ivf(self, index):
+        """用 Flat 索引里已归一化的向量训练并建出 IVF 索引，无需回库读取"""
+        import faiss
+        total = index.ntotal
+        vectors = faiss.downcast_index(index.index).reconstruct_n(0, total)
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        nlist = min(IVF_MAX_NLIST, int(4 * math.sqrt(total)))
+        upgraded = self._new_index(vectors.shape[1], nlist, [vectors[:nlist * 40]])
+        upgraded.add_with_ids(vectors, ids)
+        print(f"[{self.label}] 记录数达到 {total}，已由 Flat 转为 IVF（nlist={nlist}）")
+        return upgraded
+
+    # ---------- 重建 / 一致性 ----------
+    def rebuild(self, db: Session) -> int:
+        """
+        按数据库中全部应收录的记录重建索引（兼作压缩）。向量优先从向量存储读取，缺失的才重新编码。
+        记录数达到 IVF_MIN_RECORDS 时改用 IVF 倒排索引，使新-旧检索不再随历史规模线性增长。
+        """
+        # 先只取 id，再按块加载记录，避免流式游标与写回向量的语句共用同一连接
+        ids = [row.id for row in self._scope(db.query(DisasterInfo.id)).order_by(DisasterInfo.id)]
+        total = len(ids)
+        use_ivf = total >= IVF_MIN_RECORDS
+        nlist = min(IVF_MAX_NLIST, int(4 * math.sqrt(total))) if use_ivf else 0
+        train_size = min(total, nlist * 40)
+
+        index = None
+        pending_ids, pending_vecs = [], []
+        for start in range(0, total, REBUILD_CHUNK):
+            # 只取计算内容哈希 / 编码所需的列
+            chunk = db.query(
+                DisasterInfo.id, DisasterInfo.time, DisasterInfo.location,
+                DisasterInfo.event, DisasterInfo.level,
+            ).filter(
+                DisasterInfo.id.in_(ids[start:start + REBUILD_CHUNK])
+            ).all()
+            pending_ids.extend(r.id for r in chunk)
+            pending_vecs.append(self._vectors(db, chunk))
+            if index is None and len(pending_ids) >= train_size:
+                # IVF 需要先用一部分样本训练聚类中心，攒够样本后再建索引
+                index = self._new_index(pending_vecs[0].shape[1], nlist, pending_vecs)
+            if index is not None:
+                index.add_with_ids(_normalized(np.vstack(pending_vecs)), _as_ids(pending_ids))
+                pending_ids, pending_vecs = [], []
+        db.commit()  # 提交重建过程中补算的向量
+
+        with self._lock, self._file_lock():
+            if index is None:
+                # 没有任何历史记录：删掉旧索引文件
+                self._index = None
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self._version = None
+                return 0
+            self._index = index
+            self._save()
+            print(f"[{self.label}] 重建完成，共 {index.ntotal} 条（{'IVF' if use_ivf else 'Flat'}）")
+            return index.ntotal
+
+    def _new_index(self, dim: int, nlist: int, train_vectors: list):
+        import faiss
+        if not nlist:
+            return faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        quantizer = faiss.IndexFlatIP(dim)
+        ivf = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        ivf.train(_normalized(np.vstack(train_vectors)))
+        ivf.nprobe = IVF_NPROBE
+        return ivf
+
+    # ---------- 收录范围 / 向量来源（子类可覆盖） ----------
+    def _scope(self, query):
+        """索引收录的记录：已比对的历史记录"""
+        return query.filter(DisasterInfo.has_been_checked == True)
+
+    def _vectors(self, db: Session, rows) -> np.ndarray:
+        """记录的融合向量，优先复用向量存储"""
+        return get_vectors(db, rows)
+
+    def ids(self) -> np.ndarray:
+        """索引中全部记录的 id"""
+        import faiss
+        with self._lock:
+            index = self._get()
+            if index is None:
+                return _as_ids([])
+            ivf = self._ivf(index)
+            if ivf is None:
+                return faiss.vector_to_array(index.id_map).astype(np.int64)
+            lists = [
+                faiss.rev_swig_ptr(ivf.invlists.get_ids(no), ivf.invlists.list_size(no)).copy()
+                for no in range(ivf.nlist) if ivf.invlists.list_size(no)
+            ]
+            return np.concatenate(lists).astype(np.int64) if lists else _as_ids([])
+
+    def repair(self, db: Session) -> tuple[int, int]:
+        """
+        按 id 对账增量修复：补上数据库里有、索引里没有的记录，删掉索引里已不存在的记录，返回 (补入数, 删除数)。
+        只编码缺失的记录，不做全量重建；索引文件不存在时才整体重建。
+        """
+        if self.ntotal == 0:
+            total = self.rebuild(db)
+            return total, 0
+        # 先取索引快照再查库：提交后才写索引，库里查不到而索引里有的只可能是已删除的记录
+        indexed = set(self.ids().tolist())
+        expected = {row.id for row in self._scope(db.query(DisasterInfo.id))}
+        missing = sorted(expected - indexed)
+        extra = sorted(indexed - expected)
+        for start in range(0, len(missing), REBUILD_CHUNK):
+            chunk = db.query(
+                DisasterInfo.id, DisasterInfo.time, DisasterInfo.location,
+                DisasterInfo.event, DisasterInfo.level,
+            ).filter(
+                DisasterInfo.id.in_(missing[start:start + REBUILD_CHUNK])
+            ).all()
+            if chunk:
+                self.add([r.id for r in chunk], self._vectors(db, chunk))
+        db.commit()  # 提交补算的向量
+        self.remove(extra)
+        if missing or extra:
+            print(f"[{self.label}] 对账修复：补入 {len(missing)} 条，删除 {len(extra)} 条")
+        return len(missing), len(extra)
+
+    def ensure_synced(self, db: Session):
+        """索引条数与数据库中应收录的记录数不一致（索引缺失、进程中途退出等）时重建"""
+        expected = self._scope(db.query(func.count(DisasterInfo.id))).scalar()
+        if self.ntotal != expected:
+            print(f"[{self.label}] 索引 {self.ntotal} 条，数据库 {expected} 条，开始重建")
+            self.rebuild(db)
+
+
+disaster_index = DisasterIndex()
+
+
+if __name__ == "__main__":
+    # 用法：python -m app.utils.vector_index rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m app.utils.vector_index rebuild")
+        sys.exit(1)
+    from app.db.session import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        disaster_index.rebuild(session)
+    finally:
+        session.close()
@@ -8,11 +8,33 @@ export function submitReport(text) {
   return axios.post(`${BASE_URL}/report`, { text });
 }
 
+// 批量导入（JSONL / CSV / xlsx），返回逐行结果的 NDJSON
+export function bulkUpload(file) {
+  const form = new FormData();
+  form.append("file", file);
+  return axios.post(`${BASE_URL}/report/bulk`, form, { responseType: "text" });
+}
+
+// 查询单条报告
+export function getReport(id) {
+  return axios.get(`${BASE_URL}/report/${id}`);
+}
+
+// 查询报告的后台抽取状态（pending / processing / done / failed）
+export function getReportStatus(id) {
+  return axios.get(`${BASE_URL}/report/${id}/status`);
+}
+
 // 查询报告列表（分页 + 关键词）
 export function fetchReports(params = {}) {
   return axios.get(`${BASE_URL}/reports`, { params });
 }
 
+// 语义检索报告（q 为查询文本，可选 k / event / date_from / date_to / cursor）
+export function searchReportsSemantic(params = {}) {
+  return axios.get(`${BASE_URL}/reports/semantic`, { params });
+}
+
 // 更新报告，重新全文推理（管理员）
 export function updateReport(id, text) {
   return axios.put(`${BASE_URL}/report/${id}`, { text });
@@ -28,13 +50,13 @@ export function updateDisasterInfo(id, data) {
   return axios.put(`${BASE_URL}/disaster-info/${id}`, data);
 }
 
-// 导出为 Excel 文件（用户/管理员均可）
-export function exportExcel(token, keyword = "") {
+// 导出为 Excel / CSV 文件（用户/管理员均可），format 可选 xlsx / csv / csv.gz
+export function exportExcel(token, keyword = "", format = "xlsx") {
   return axios.get(`${BASE_URL}/reports/export_excel`, {
     headers: {
       Authorization: `Bearer ${token}`,
     },
-    params: { q: keyword },
+    params: { q: keyword, format },
     responseType: "blob",
   });
 }
@@ -44,4 +66,11 @@ export function runDedup(token) {
   return axios.post(`${BASE_URL}/dedup`, {}, {
     headers: { Authorization: `Bearer ${token}` }
   });
-}
\ No newline at end of file
+}
+
+//查询去重任务进度(管理员)
+export function getDedupJob(token, jobId) {
+  return axios.get(`${BASE_URL}/dedup/jobs/${jobId}`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+}
@@ -1,6 +1,6 @@
 // src/pages/ReportList.jsx
-import { useEffect, useState, useContext } from "react";
-import { fetchReports, deleteReport, updateReport, updateDisasterInfo, exportExcel, runDedup } from "../api/reports";
+import { useEffect, useState, useContext, useRef } from "react";
+import { fetchReports, deleteReport, updateReport, updateDisasterInfo, exportExcel, runDedup, getDedupJob } from "../api/reports";
 import { AuthContext } from "../context/AuthContext";
 import RequireAuth from "../components/RequireAuth";
 import "../App.css";
@@ -14,6 +14,8 @@ export default function ReportList() {
   const [page, setPage] = useState(1);
   const [pageSize] = useState(10); // 固定每页数量
   const [total, setTotal] = useState(0);
+  // 每页的键集分页游标：page -> cursor，翻到下一页时使用上一页返回的 next_cursor
+  const cursors = useRef({});
   const [editRecord, setEditRecord] = useState(null);
   const [editInfos, setEditInfos] = useState([]);
   const [useRerun, setUseRerun] = useState(false);
@@ -24,7 +26,10 @@ export default function ReportList() {
   const loadData = async () => {
     setLoading(true);
     try {
-      const res = await fetchReports({ q: keyword, page, page_size: pageSize });
+      const params = { q: keyword, page, page_size: pageSize };
+      if (cursors.current[page]) params.cursor = cursors.current[page];
+      const res = await fetchReports(params);
+      if (res.data.next_cursor) cursors.current[page + 1] = res.data.next_cursor;
       setData(res.data.items || res.data);  // 适配接口格式
       setTotal(res.data.total || res.data.length);
     } catch (err) {
@@ -34,6 +39,10 @@ export default function ReportList() {
     }
   };
 
+  useEffect(() => {
+    cursors.current = {};  // 关键词变化后游标全部失效
+  }, [keyword]);
+
   useEffect(() => {
     loadData();
     const timer = setInterval(loadData, 10000); // 每 10 秒自动刷新
@@ -70,7 +79,17 @@ export default function ReportList() {
     setDedupLoading(true);
     try {
       const res = await runDedup(token);
-      const clusters = res.data?.cluster_details || [];
+      // 去重在后台执行，轮询任务状态直到结束
+      let job = res.data;
+      while (job.status === "pending" || job.status === "running") {
+        await new Promise((r) => setTimeout(r, 2000));
+        job = (await getDedupJob(token, job.job_id)).data;
+      }
+      if (job.status !== "done") {
+        alert(job.status === "cancelled" ? "去重已取消。" : "去重失败：" + (job.error || job.status));
+        return;
+      }
+      const clusters = job.result?.cluster_details || [];
   
       if (clusters.length === 0) {
         alert("没有发现需要合并的记录。");
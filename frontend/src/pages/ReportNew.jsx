@@ -1,6 +1,6 @@
 // src/pages/ReportNew.jsx
 import { useState } from "react";
-import { submitReport } from "../api/reports";
+import { submitReport, getReport, getReportStatus } from "../api/reports";
 import RequireAuth from "../components/RequireAuth";
 
 export default function ReportNew() {
@@ -15,7 +15,20 @@ export default function ReportNew() {
     setResult(null);
 
     try {
-      const res = await submitReport(text);
+      let res = await submitReport(text);
+      if (res.status === 202) {
+        // 后台抽取模式：轮询状态，完成后再取完整报告
+        let state = res.data;
+        while (state.status === "pending" || state.status === "processing") {
+          await new Promise((r) => setTimeout(r, 2000));
+          state = (await getReportStatus(state.report_id)).data;
+        }
+        if (state.status !== "done") {
+          alert("抽取失败：" + (state.error || state.status));
+          return;
+        }
+        res = await getReport(state.report_id);
+      }
       setResult(res.data);
       setText("");  // 提交成功后清空输入框
     } catch (err) {
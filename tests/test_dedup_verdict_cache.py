@@ -0,0 +1,88 @@
+# tests/test_dedup_verdict_cache.py
+
+import datetime
+import importlib
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("httpx")
+pytest.importorskip("dotenv")
+
+DIM = 8
+
+
+def _vector(location: str) -> np.ndarray:
+    """珠海 / 中山 两条记录的余弦相似度约为 0.75，落在默认的模糊区间 [0.6, 0.9)"""
+    vec = np.zeros(DIM, dtype=np.float32)
+    if location == "珠海市":
+        vec[0] = 1.0
+    else:
+        vec[0], vec[1] = 0.75, 0.6614
+    return vec
+
+
+@pytest.fixture
+def app_modules(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path / 'dedup.db'}")
+    monkeypatch.setenv("FAISS_INDEX_PATH", str(tmp_path / "disaster_info.index"))
+    # 数据库地址、索引路径在导入时读取，按本测试的环境重新加载
+    import app.db.session as session
+    session = importlib.reload(session)
+    import app.utils.vector_index as vector_index
+    vector_index = importlib.reload(vector_index)
+    import app.core.verdict_cache as verdict_cache
+    verdict_cache = importlib.reload(verdict_cache)
+    import app.core.llm_service as llm_service
+    llm_service = importlib.reload(llm_service)
+    import app.utils.full_dedup_engine as engine
+    engine = importlib.reload(engine)
+
+    monkeypatch.setattr(
+        "app.utils.embedding_store.encode_disaster_batch",
+        lambda records: np.vstack([_vector(r.location) for r in records]),
+    )
+    monkeypatch.setattr(llm_service, "_judge_similarity_batch", lambda pairs: [True] * len(pairs))
+    monkeypatch.setattr(llm_service, "_judge_similarity", lambda t1, t2: True)
+
+    session.init_db()
+    return session, engine
+
+
+def test_fuzzy_verdicts_are_persisted_on_sqlite(app_modules):
+    session, engine = app_modules
+    from app.models.report import Report
+    from app.models.disaster_info import DisasterInfo
+    from app.models.llm_verdict import LLMVerdict
+
+    db = session.SessionLocal()
+    try:
+        db.add(Report(
+            text="台风",
+            summary="台风",
+            created_at=datetime.datetime.utcnow(),
+            disaster_infos=[
+                DisasterInfo(time="2024年9月15日", location=loc, event="台风", level="道路积水")
+                for loc in ("珠海市", "中山市")
+            ],
+        ))
+        db.commit()
+
+        started = time.monotonic()
+        pairs = engine.find_similar_disaster_infos(db)
+        elapsed = time.monotonic() - started
+    finally:
+        db.close()
+
+    assert len(pairs) == 1
+    # 写判定缓存不应再等待 SQLite 的 busy timeout（5 秒）
+    assert elapsed < 5
+
+    check = session.SessionLocal()
+    try:
+        assert check.query(LLMVerdict).count() == 1
+    finally:
+        check.close()
@@ -0,0 +1,50 @@
+# tests/test_vector_index.py
+
+import importlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("sqlalchemy")
+
+DIM = 16
+
+
+@pytest.fixture
+def vector_index(monkeypatch):
+    monkeypatch.setenv("FAISS_IVF_MIN_RECORDS", "200")
+    # 阈值在导入时读取，按本测试的环境重新加载
+    import app.utils.vector_index as module
+    return importlib.reload(module)
+
+
+def _top1(index, vectors) -> list[int]:
+    _, ids = index.search(vectors, 1)
+    return [int(i) for i in ids[:, 0]]
+
+
+def test_ivf_index_keeps_ids_after_remove_and_overwrite(vector_index, tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, DIM)).astype(np.float32)
+    ids = list(range(1, 401))
+
+    index = vector_index.DisasterIndex(str(tmp_path / "disaster_info.index"))
+    index.add(ids[:150], vectors[:150])
+    index.add(ids[150:], vectors[150:])  # 跨过阈值，转为 IVF
+    assert isinstance(faiss.downcast_index(index._get()), faiss.IndexIVF)
+
+    index.remove([1, 2, 3, 4, 5])
+    assert index.ntotal == 395
+    assert _top1(index, vectors[300:305]) == [301, 302, 303, 304, 305]
+
+    # 覆盖写入（先删后加）后，其余记录的 id 仍然对得上
+    replaced = rng.standard_normal((2, DIM)).astype(np.float32)
+    index.add([10, 11], replaced)
+    assert index.ntotal == 395
+    assert _top1(index, replaced) == [10, 11]
+    assert _top1(index, vectors[350:353]) == [351, 352, 353]
+
+    # 从磁盘重新加载后结果一致
+    reloaded = vector_index.DisasterIndex(str(tmp_path / "disaster_info.index"))
+    assert _top1(reloaded, vectors[300:305]) == [301, 302, 303, 304, 305]